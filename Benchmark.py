@@ -0,0 +1,202 @@
+import argparse
+import contextlib
+import csv
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from CreateSchedule import observatory_sites, build_observatory, build_targets
+from RunMetrics import RunMetrics
+from Utilities import load_target_catalog
+
+
+# Share of each target type in a synthetic catalog
+synthetic_type_mix = {
+    "SN": 0.55,
+    "TMP": 0.15,
+    "STD": 0.05,
+    "GW_Static": 0.15,
+    "GW_Dynamic": 0.10
+}
+
+def format_sexagesimal(values, sign):
+    values = np.asarray(values, dtype=float)
+    negative = values < 0
+    values = np.abs(values)
+    whole = np.floor(values).astype(int)
+    minutes = np.floor((values - whole)*60).astype(int)
+    seconds = (values - whole - minutes/60.0)*3600
+
+    return ["%s%02d:%02d:%05.2f" % ("-" if n else ("+" if sign else ""), w, m, s) \
+            for n, w, m, s in zip(negative, whole, minutes, seconds)]
+
+# Seeded synthetic targets CSV in the CreateSchedule format: RA uniform, Dec uniform on the
+# sphere (so both sites see a realistic share of the catalog), SN discovered in the last 120 days
+def write_synthetic_catalog(file_name, num_targets, obs_date, seed):
+    rng = np.random.default_rng(seed)
+
+    codes = list(synthetic_type_mix.keys())
+    types = rng.choice(codes, size=num_targets, p=list(synthetic_type_mix.values()))
+    ra_hours = rng.uniform(0, 24, num_targets)
+    dec_degrees = np.degrees(np.arcsin(rng.uniform(-1, 1, num_targets)))
+    priorities = rng.integers(1, 6, num_targets)
+    disc_dates = [(obs_date - timedelta(days=int(d))).strftime("%Y-%m-%d") for d in rng.integers(0, 120, num_targets)]
+    disc_mags = rng.uniform(14.5, 19.5, num_targets)
+    static_exp_times = rng.choice([60, 120, 180], size=num_targets)
+    est_abs_mags = rng.uniform(-19, -16, num_targets)
+    host_dists = rng.uniform(20, 200, num_targets)
+
+    with open(file_name, "w") as csvoutput:
+        writer = csv.writer(csvoutput, lineterminator="\n")
+        writer.writerow(["Name", "RA", "Dec", "Priority", "DiscDate", "DiscMag", "Type", "StaticExpTime", "EstAbsMag", "HostDistMpc"])
+        for row in zip(["S%06d" % i for i in range(num_targets)], format_sexagesimal(ra_hours, False), \
+                       format_sexagesimal(dec_degrees, True), priorities, disc_dates, np.round(disc_mags, 2), types, \
+                       static_exp_times, np.round(est_abs_mags, 2), np.round(host_dists, 1)):
+            writer.writerow(row)
+
+# Times every stage of one (observatory, telescope, catalog size) run. Stages run in pipeline
+# order, each timed with tracemalloc off; a second, traced pass records each stage's peak memory.
+class StageTimer():
+    def __init__(self, trace_memory):
+        self.trace_memory = trace_memory
+        self.results = {}
+
+    def run(self, stage, func, *args, **kwargs):
+        gc.collect()
+        if self.trace_memory:
+            tracemalloc.start()
+
+        begin = time.perf_counter()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            result = func(*args, **kwargs)
+        seconds = time.perf_counter() - begin
+
+        if self.trace_memory:
+            self.results[stage] = {"peak_memory_mb": tracemalloc.get_traced_memory()[1]/2.0**20}
+            tracemalloc.stop()
+        else:
+            self.results[stage] = {"seconds": seconds}
+
+        return result
+
+def run_pipeline(catalog_file, obs_key, tele_key, obs_date, options, timer):
+    catalog = timer.run("load_catalog", load_target_catalog, catalog_file)
+    obs = timer.run("observatory", build_observatory, obs_key, obs_date, options)
+    telescope = obs.telescopes[tele_key]
+
+    targets = timer.run("targets", build_targets, catalog, obs, RunMetrics(), options["airmass_storage"])
+    telescope.set_targets(targets)
+
+    timer.run("compute_exposures", telescope.compute_exposures)
+    timer.run("compute_net_priorities", telescope.compute_net_priorities)
+    scheduled, unscheduled = timer.run("schedule_targets", obs.place_targets, tele_key, options["slot_search"])
+    timer.run("write_schedule", telescope.write_schedule, obs.name, obs.obs_date, scheduled)
+
+    def plot():
+        obs.plot_results(scheduled, tele_key, show_plot=False)
+        obs.wait_for_plots()
+    timer.run("plot_results", plot)
+
+    return len(scheduled), len(unscheduled)
+
+def benchmark(sizes, pairs, obs_date, seed, repeat, options, trace_memory=True):
+    if repeat < 1:
+        raise ValueError("Benchmark repeat must be at least 1 (got %s)!" % repeat)
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        cwd = os.getcwd()
+        os.chdir(work_dir) # schedules and plots are written to the working directory
+        try:
+            for num_targets in sizes:
+                catalog_file = "synthetic_%s.csv" % num_targets
+                write_synthetic_catalog(catalog_file, num_targets, datetime.strptime(obs_date, "%Y%m%d"), seed)
+
+                for obs_key, tele_key in pairs:
+                    stages = {}
+                    for r in range(repeat):
+                        timer = StageTimer(trace_memory=False)
+                        num_scheduled, num_unscheduled = run_pipeline(catalog_file, obs_key, tele_key, obs_date, options, timer)
+                        for stage, result in timer.results.items():
+                            stages[stage] = min(stages.get(stage, result["seconds"]), result["seconds"])
+
+                    report = {stage: {"seconds": seconds} for stage, seconds in stages.items()}
+                    if trace_memory:
+                        timer = StageTimer(trace_memory=True)
+                        run_pipeline(catalog_file, obs_key, tele_key, obs_date, options, timer)
+                        for stage, result in timer.results.items():
+                            report[stage].update(result)
+
+                    results.append({
+                        "targets": num_targets,
+                        "observatory": obs_key,
+                        "telescope": tele_key,
+                        "scheduled": num_scheduled,
+                        "unscheduled": num_unscheduled,
+                        "total_seconds": sum(stages.values()),
+                        "stages": report
+                    })
+                    print("%7s targets %s:%s %8.3f s  %s" % (num_targets, obs_key, tele_key, sum(stages.values()), \
+                          "  ".join("%s=%0.3f" % (stage, seconds) for stage, seconds in stages.items())))
+        finally:
+            os.chdir(cwd)
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Time and profile each scheduling stage on seeded synthetic catalogs.")
+    parser.add_argument("-s", "--sizes", default="10,100,1000,10000,100000", help="Comma-delimited catalog sizes. Default: 10,100,1000,10000,100000.")
+    parser.add_argument("-ot", "--obstele", default="LCO:Swope,Lick:Nickel", help="Comma-delimited list of <Observatory>:<Telescope>. Default: both sites.")
+    parser.add_argument("-d", "--date", default="20170601", help="YYYYMMDD formatted observation date. Default: 20170601.")
+    parser.add_argument("--seed", type=int, default=0, help="Catalog generator seed. Default: 0.")
+    parser.add_argument("-r", "--repeat", type=int, default=1, help="Timed runs per case; the fastest is reported. Default: 1.")
+    parser.add_argument("-ss", "--slotsearch", default="prefix", choices=["prefix", "greedy", "packed"], help="Slot search engine. Default: prefix.")
+    parser.add_argument("-as", "--airmassstorage", default=None, choices=["float32", "uint16"], help="Airmass cache encoding to benchmark (see TargetCatalog).")
+    parser.add_argument("--nomemory", action="store_true", help="Skip the (slower) tracemalloc pass.")
+    parser.add_argument("-o", "--output", default="benchmark.json", help="JSON results file. Default: benchmark.json.")
+    args = parser.parse_args()
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    os.environ["MPLBACKEND"] = "Agg"
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    pairs = [tuple(ot.split(":")) for ot in args.obstele.split(",")]
+    for obs_key, tele_key in pairs:
+        if obs_key not in observatory_sites:
+            raise ValueError("Unknown observatory '%s'!" % obs_key)
+
+    options = {
+        "cache_dir": None,
+        "time_step": 60,
+        "slot_search": args.slotsearch,
+        "airmass_storage": args.airmassstorage,
+        "plot_dpi": 300,
+        "plot_legend": True
+    }
+
+    results = benchmark(sizes, pairs, args.date, args.seed, args.repeat, options, trace_memory=not args.nomemory)
+
+    with open(args.output, "w") as jsonoutput:
+        json.dump({
+            "date": args.date,
+            "seed": args.seed,
+            "slot_search": args.slotsearch,
+            "airmass_storage": args.airmassstorage,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "results": results
+        }, jsonoutput, indent=2)
+    print("Wrote %s" % args.output)
+
+    return 0
+
+if __name__ == "__main__": sys.exit(main())
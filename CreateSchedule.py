@@ -1,134 +1,346 @@
+import time
+start_time = time.perf_counter() # cold-start timing; keep above the other imports
+
 import Constants
 from Observatory import Observatory
 from Telescope import Swope, Nickel
 from Utilities import *
-from Target import TargetType, Target
+from Target import TargetCatalog
+from RunMetrics import RunMetrics
+from Network import allocate_targets, record_placements, site_targets
+from ScheduleArchive import ScheduleArchive
 
-from dateutil.parser import parse
 import argparse
-from astropy.coordinates import SkyCoord
-from astropy import units as unit
-
-
-def main():
-
-	parser = argparse.ArgumentParser()
-	parser.add_argument("-f", "--file", help="CSV file with targets to schedule.")
-	parser.add_argument("-d", "--date", help="YYYYMMDD formatted observation date.")
-	parser.add_argument("-ot", "--obstele", help="Comma-delimited list of <Observatory>:<Telescope>, to schedule targets.")
-	args = parser.parse_args()
+import csv
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
 
-	file_name = args.file
-	obs_date = args.date
-	observatory_telescopes = args.obstele.split(",")
-	
-	obs_keys = [o.split(":")[0] for o in observatory_telescopes]
-	tele_keys = [t.split(":")[1] for t in observatory_telescopes]
+log = logging.getLogger(__name__)
 
-	lco = Observatory(
+# Observatory definitions, keyed by the <Observatory> part of --obstele
+observatory_sites = {
+	"LCO": dict(
 		name="LCO",
 		lon="-70.6915",
 		lat="-29.0182",
 		elevation=2402,
 		horizon="-12",
-		telescopes={"Swope":Swope()},
-		obs_date_str=obs_date,
+		telescopes=lambda: {"Swope":Swope()},
 		utc_offset=lco_clst_utc_offset,
 		utc_offset_name="CLST"
-	)
-
-	lick = Observatory(
+	),
+	"Lick": dict(
 		name="Lick",
 		lon="-121.6429",
 		lat="37.3414",
 		elevation=1283,
 		horizon="-12",
-		telescopes={"Nickel":Nickel()},
-		obs_date_str=obs_date,
+		telescopes=lambda: {"Nickel":Nickel()},
 		utc_offset=lick_pst_utc_offset,
 		utc_offset_name="PST"
 	)
+}
+
+def build_observatory(obs_key, obs_date, options):
+	site = dict(observatory_sites[obs_key])
+	site["telescopes"] = site["telescopes"]()
+
+	return Observatory(
+		obs_date_str=obs_date,
+		cache_dir=options["cache_dir"],
+		time_step=options["time_step"],
+		plot_dpi=options["plot_dpi"],
+		plot_legend=options["plot_legend"],
+		**site
+	)
+
+def read_target_catalog(file_name):
+	catalog = load_target_catalog("%s" % file_name)
+	if len(catalog) == 0:
+		raise ValueError("No valid targets in %s!" % file_name)
+
+	return catalog
+
+# Target views onto a per-observatory TargetCatalog, which holds the observable windows and results.
+# Targets that never reach the airmass limit from this site tonight are rejected first (see
+# Observatory.select_observable) and recorded in metrics.
+def build_targets(catalog, obs, metrics, airmass_storage=None):
+	records, record_index, rejected = obs.select_observable(catalog)
+	metrics.count("rejected", len(rejected))
+	metrics.set("rejected_targets", rejected)
+
+	return TargetCatalog(records, obs.ephemeris.lat, obs.sidereal_radian_array, obs.obs_date, record_index=record_index, \
+						 airmass_storage=airmass_storage, time_step=obs.time_step).targets()
+
+# Schedule one telescope for one night and summarize the result
+def schedule_telescope(catalog, obs, tele_key, options):
+	metrics = RunMetrics()
+	with metrics.stage("targets"):
+		targets = build_targets(catalog, obs, metrics, options["airmass_storage"])
+	telescope = obs.telescopes[tele_key]
+	telescope.set_targets(targets)
+
+	log.info("# of %s targets: %s", tele_key, len(targets))
+	if len(targets) > 0:
+		log.debug("First %s target: %s", tele_key, targets[0].name)
+		log.debug("Last %s target: %s", tele_key, targets[-1].name)
+
+	good_targets, bad_targets = obs.schedule_targets(tele_key, slot_search=options["slot_search"], coarse_factor=options["coarse_factor"], \
+													 optimize_seconds=options["optimize_seconds"], tighten=options["tighten"], \
+													 plot=options["plot"], show_plot=options["show_plot"], metrics=metrics, \
+													 archive=open_archive(options))
+
+	return summarize_schedule(obs, tele_key, targets, good_targets, bad_targets, metrics)
+
+def summarize_schedule(obs, tele_key, targets, good_targets, bad_targets, metrics):
+	telescope = obs.telescopes[tele_key]
+	scheduled_minutes = sum(obs.block_minutes(t) for t in good_targets)
+	return {
+		"Date": obs.obs_date_string,
+		"Observatory": obs.name,
+		"Telescope": tele_key,
+		"Targets": len(targets),
+		"Scheduled": len(good_targets),
+		"Unfit": len(bad_targets),
+		"Unobservable": len(targets) - len(good_targets) - len(bad_targets),
+		"Rejected": metrics.counters.get("rejected", 0),
+		"Scheduled Minutes": int(scheduled_minutes),
+		"Night Minutes": obs.length_of_night,
+		"Open Shutter Percent": round(100*float(scheduled_minutes)/float(obs.length_of_night), 2),
+		"Schedule File": telescope.schedule_file_name(obs.name, obs.obs_date)
+	}
+
+def open_archive(options):
+	return ScheduleArchive(options["archive"]) if options["archive"] is not None else None
+
+# Network mode: all requested telescopes share one catalog for the night, and each target goes to
+# at most options["max_telescopes"] of them (see Network.allocate_targets). The allocation is
+# computed at full resolution, so coarse_factor does not apply. Sites are then scheduled in turn,
+# each offered only the targets still under the limit given what the others placed, and the
+# allocation CSV records the final placements.
+def schedule_network(catalog, pairs, obs_date, options):
+	observatories = {}
+	sites = []
+	site_metrics = []
+	for obs_key, tele_key in pairs:
+		if obs_key not in observatories:
+			observatories[obs_key] = build_observatory(obs_key, obs_date, options)
+		obs = observatories[obs_key]
+
+		metrics = RunMetrics(mode="network")
+		with metrics.stage("targets"):
+			targets = build_targets(catalog, obs, metrics, options["airmass_storage"])
+		site_metrics.append(metrics)
+
+		telescope = obs.telescopes[tele_key]
+		telescope.set_targets(targets)
+		telescope.compute_exposures()
+		telescope.compute_net_priorities()
+		sites.append((obs, tele_key))
+
+	placements = allocate_targets(sites, options["max_telescopes"], options["slot_search"])
+
+	summaries = []
+	for s, ((obs, tele_key), metrics) in enumerate(zip(sites, site_metrics)):
+		targets = site_targets(sites, s, placements, options["max_telescopes"])
+		obs.telescopes[tele_key].set_targets(targets)
+		good_targets, bad_targets = obs.schedule_targets(tele_key, slot_search=options["slot_search"], optimize_seconds=options["optimize_seconds"], \
+														 tighten=options["tighten"], plot=options["plot"], show_plot=options["show_plot"], \
+														 metrics=metrics, precomputed=True, archive=open_archive(options))
+		record_placements(placements, s, good_targets)
+		summaries.append(summarize_schedule(obs, tele_key, targets, good_targets, bad_targets, metrics))
+
+	write_allocation(catalog, sites, placements, obs_date)
+
+	for obs in observatories.values():
+		obs.wait_for_plots()
+
+	return summaries
+
+# Which telescope(s) each catalog target was given
+def write_allocation(catalog, sites, placed, obs_date):
+	file_to_write = "Network_%s_Allocation.csv" % obs_date
+	with open(file_to_write, "w") as csvoutput:
+		writer = csv.writer(csvoutput, lineterminator="\n")
+		writer.writerow(["Object Name", "Telescopes"])
+		for index, name in enumerate(catalog["name"]):
+			writer.writerow([name, ";".join("%s:%s" % (sites[s][0].name, sites[s][1]) for s in sorted(placed.get(index, [])))])
+
+	log.info("Wrote %s", file_to_write)
+
+def network_night(pairs, obs_date, options):
+	return schedule_network(worker_catalog, pairs, obs_date, dict(options, show_plot=False))
+
+# Pool mode (several nights and/or several telescopes): every (observatory, telescope, night) job
+# is independent, so each runs in its own process. Each worker receives the parsed catalog once,
+# through the pool initializer.
+worker_catalog = None
+
+def init_pool_worker(catalog, log_level):
+	global worker_catalog
+	worker_catalog = catalog
+	configure_logging(log_level)
+
+	os.environ["MPLBACKEND"] = "Agg" # workers never display plots
+
+def schedule_night(obs_key, tele_key, obs_date, options):
+	obs = build_observatory(obs_key, obs_date, options)
+	summary = schedule_telescope(worker_catalog, obs, tele_key, dict(options, show_plot=False))
+	obs.wait_for_plots()
+
+	return summary
+
+def date_range(start_date, end_date):
+	start = datetime.strptime(start_date, "%Y%m%d")
+	end = datetime.strptime(end_date, "%Y%m%d")
+	return [(start + timedelta(days=d)).strftime("%Y%m%d") for d in range((end - start).days + 1)]
+
+# Concatenate the per-night schedules of each telescope (with a leading Date column) and write
+# the per-night summaries, in date order
+def write_season_report(summaries, start_date, end_date):
+	summaries = sorted(summaries, key=lambda s: (s["Observatory"], s["Telescope"], s["Date"]))
+
+	season_files = {}
+	for summary in summaries:
+		key = (summary["Observatory"], summary["Telescope"])
+		if key not in season_files:
+			season_files[key] = []
+		season_files[key].append(summary)
+
+	for (obs_name, tele_name), nights in season_files.items():
+		file_to_write = "%s_%s_%s_%s_SeasonSchedule.csv" % (obs_name, tele_name, start_date, end_date)
+		with open(file_to_write, "w") as csvoutput:
+			writer = csv.writer(csvoutput, lineterminator="\n")
+			header_written = False
+
+			for night in nights:
+				with open(night["Schedule File"], "r") as csvinput:
+					reader = csv.reader(csvinput)
+					header = next(reader, None)
+					if not header_written and header is not None:
+						writer.writerow(["Date"] + header)
+						header_written = True
+					writer.writerows([night["Date"]] + row for row in reader)
+
+		log.info("Wrote %s", file_to_write)
+
+	summary_file = "Season_%s_%s_Summary.csv" % (start_date, end_date)
+	with open(summary_file, "w") as csvoutput:
+		fields = ["Date", "Observatory", "Telescope", "Targets", "Scheduled", "Unfit", "Unobservable", "Rejected", \
+				  "Scheduled Minutes", "Night Minutes", "Open Shutter Percent", "Schedule File"]
+		writer = csv.DictWriter(csvoutput, fieldnames=fields, lineterminator="\n")
+		writer.writeheader()
+		writer.writerows(summaries)
+
+	for (obs_name, tele_name), nights in season_files.items():
+		scheduled = sum(n["Scheduled Minutes"] for n in nights)
+		available = sum(n["Night Minutes"] for n in nights)
+		log.info("%s %s: %s nights, %s targets scheduled, Open Shutter Time: %0.2f%%", \
+				 obs_name, tele_name, len(nights), sum(n["Scheduled"] for n in nights), 100*float(scheduled)/float(available))
+	log.info("Wrote %s", summary_file)
+
+def schedule_in_pool(catalog, pairs, dates, options, workers=None):
+	initargs = (catalog, logging.getLogger().level)
+	with ProcessPoolExecutor(max_workers=workers, initializer=init_pool_worker, initargs=initargs) as executor:
+		# Network nights allocate across all telescopes at once, so the job is the whole night
+		if options["network"]:
+			futures = [executor.submit(network_night, pairs, obs_date, options) for obs_date in dates]
+			return [summary for f in futures for summary in f.result()]
+
+		futures = [executor.submit(schedule_night, obs_key, tele_key, obs_date, options) \
+				   for obs_date in dates for obs_key, tele_key in pairs]
+		return [f.result() for f in futures]
+
+def configure_logging(level):
+	logging.basicConfig(level=level, format="%(message)s")
+
+def main():
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument("-f", "--file", help="CSV file with targets to schedule.")
+	parser.add_argument("-d", "--date", help="YYYYMMDD formatted observation date.")
+	parser.add_argument("-ed", "--enddate", default=None, help="YYYYMMDD formatted last observation date. Schedules every night from --date through --enddate in parallel.")
+	parser.add_argument("-w", "--workers", type=int, default=None, help="Number of worker processes for multi-night or multi-telescope runs; 1 schedules serially. Default: # of CPUs.")
+	parser.add_argument("-ot", "--obstele", help="Comma-delimited list of <Observatory>:<Telescope>, to schedule targets.")
+	parser.add_argument("-ss", "--slotsearch", default="prefix", choices=["prefix", "greedy", "packed"], help="Slot search engine. Default: prefix.")
+	parser.add_argument("-as", "--airmassstorage", default=None, choices=["float32", "uint16"], help="Cache every target's airmass at every time step in this encoding instead of evaluating it on demand; uses more memory, speeds up long --optimize runs.")
+	parser.add_argument("-cd", "--cachedir", default=".ephemeris_cache", help="Directory for cached twilight/sidereal time. Pass an empty string to disable.")
+	parser.add_argument("-ts", "--timestep", type=int, default=60, help="Time resolution of the night, in seconds. Default: 60.")
+	parser.add_argument("-cf", "--coarsefactor", type=int, default=None, help="Place targets on a grid this many times coarser first, then refine. Default: off.")
+	parser.add_argument("-n", "--network", action="store_true", help="Allocate targets across all --obstele telescopes jointly instead of scheduling each on its own.")
+	parser.add_argument("-mt", "--maxtelescopes", type=int, default=1, help="With --network, the most telescopes one target may be scheduled on. Default: 1.")
+	parser.add_argument("-opt", "--optimize", type=float, default=None, help="Seconds per telescope to spend improving the greedy schedule with a local search. Default: off.")
+	parser.add_argument("-tt", "--tighten", action="store_true", help="Re-size blocks for their actual slews and reorder neighbours to cut modeled dead time (see Observatory.tighten_schedule). Default: off.")
+	parser.add_argument("-a", "--archive", default=None, help="Also append every night's placements to this schedule archive directory (see ScheduleArchive.py).")
+	parser.add_argument("--headless", action="store_true", help="Non-interactive run (cron/automation): plots are only saved, with a non-interactive backend, and there is no exit prompt.")
+	parser.add_argument("--noplot", action="store_true", help="Skip the airmass plots entirely.")
+	parser.add_argument("--plotdpi", type=int, default=300, help="Resolution of saved plots. Default: 300.")
+	parser.add_argument("--nolegend", action="store_true", help="Leave the per-target legend off the plots.")
+	parser.add_argument("-l", "--loglevel", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="Console log level; DEBUG adds per-target detail. Default: INFO.")
+	args = parser.parse_args()
+
+	configure_logging(args.loglevel)
+
+	if args.headless:
+		os.environ["MPLBACKEND"] = "Agg" # matplotlib reads this when (and if) it is first imported
+
+	file_name = args.file
+	obs_date = args.date
+	observatory_telescopes = args.obstele.split(",")
+	pairs = [(ot.split(":")[0], ot.split(":")[1]) for ot in observatory_telescopes]
+
+	options = {
+		"cache_dir": args.cachedir or None,
+		"time_step": args.timestep,
+		"slot_search": args.slotsearch,
+		"coarse_factor": args.coarsefactor,
+		"airmass_storage": args.airmassstorage,
+		"archive": args.archive,
+		"optimize_seconds": args.optimize,
+		"tighten": args.tighten,
+		"network": args.network,
+		"max_telescopes": args.maxtelescopes,
+		"plot": not args.noplot,
+		"show_plot": not args.headless,
+		"plot_dpi": args.plotdpi,
+		"plot_legend": not args.nolegend
+	}
+
+	catalog = read_target_catalog(file_name)
+	log.info("Startup (imports + catalog): %0.3f s", time.perf_counter() - start_time)
+
+	if args.enddate is not None and args.enddate != obs_date:
+		dates = date_range(obs_date, args.enddate)
+		summaries = schedule_in_pool(catalog, pairs, dates, options, workers=args.workers)
+		write_season_report(summaries, dates[0], dates[-1])
+	elif args.network:
+		schedule_network(catalog, pairs, obs_date, options)
+	elif len(pairs) > 1 and args.workers != 1:
+		# Sites are independent, so schedule each <Observatory>:<Telescope> on its own core
+		summaries = schedule_in_pool(catalog, pairs, [obs_date], options, workers=args.workers)
+		for summary in summaries:
+			log.info("%s %s: %s targets scheduled, Open Shutter Time: %0.2f%% -> %s", \
+					 summary["Observatory"], summary["Telescope"], summary["Scheduled"], \
+					 summary["Open Shutter Percent"], summary["Schedule File"])
+	else:
+		observatories = {}
+		for obs_key, tele_key in pairs:
+			if obs_key not in observatories:
+				observatories[obs_key] = build_observatory(obs_key, obs_date, options)
+			schedule_telescope(catalog, observatories[obs_key], tele_key, options)
+
+		# Plots render in the background while later telescopes are scheduled
+		for obs in observatories.values():
+			obs.wait_for_plots()
+
+	log.info("Total run time: %0.3f s", time.perf_counter() - start_time)
+
+	if not args.headless:
+		exit = input("\n\nENTER to exit")
+
+	return 0
 
-	observatories = {"LCO":lco, "Lick":lick}
-
-	target_data = get_targets("%s" % file_name)
-	names = [t[0] for t in target_data]
-	ra = [t[1] for t in target_data]
-	dec = [t[2] for t in target_data]
-	priorities = [float(t[3]) for t in target_data]
-	disc_dates = [t[4] for t in target_data]
-	disc_mags = [float(t[5]) for t in target_data]
-	types = [t[6] for t in target_data]
-	static_exp_times = [float(t[7]) for t in target_data]
-	Est_Abs_Mag = [float(t[8]) for t in target_data]
-	Host_Dist_Mpc = [float(t[9]) for t in target_data]
-	#dynamic_exp_times = [t[10] for t in target_data]
-	#App_Mag = [t[11] for t in target_data]
-
-	#App_Mag is an empty list. So is dynamic exposure times. 
-	#No data is actually in these columns yet.
-
-	coords = SkyCoord(ra,dec,unit=(unit.hour, unit.deg))
-
-	for i in range(len(observatory_telescopes)):
-		
-		targets = []
-		obs = observatories[obs_keys[i]]
-
-		for j in range(len(names)):
-
-			target_type = None
-			disc_date = None
-
-			if types[j] == "STD":
-				target_type = TargetType.Standard
-				disc_date = None
-			elif types[j] == "TMP":
-				target_type = TargetType.Template
-				disc_date = parse(disc_dates[j])
-			elif types[j] == "SN":
-				target_type = TargetType.Supernova
-				disc_date = parse(disc_dates[j])
-			elif types[j] == "GW_Static":
-				target_type = TargetType.GW_Static
-				disc_date = parse(disc_dates[j])
-			elif types[j] == "GW_Dynamic":
-				target_type = TargetType.GW_Dynamic
-				disc_date = parse(disc_dates[j])
-			else:
-				raise ValueError('Unrecognized target type!')
-
-			targets.append(
-				Target(
-					name=names[j], 
-					coord=coords[j], 
-					priority=priorities[j], 
-					target_type=target_type, 
-					observatory_lat=obs.ephemeris.lat, 
-					sidereal_radian_array=obs.sidereal_radian_array, 
-					disc_date=disc_date, 
-					apparent_mag=disc_mags[j], 
-					obs_date=obs.obs_date,
-					Static_Exp_Time=static_exp_times[j],
-					Est_Abs_Mag=Est_Abs_Mag[j],
-					Host_Dist_Mpc=Host_Dist_Mpc[j]
-					#Dynamic_Exp_Time=dynamic_exp_times[j],
-					#App_Mag=App_Mag[j]
-				)
-				# Above is where you will put your new column values (assigned to the correct properties of the Target object) 
-				#Dynamic exposure times/apparent mag are not actually ever in input file, though.
-			)
-
-			obs.telescopes[tele_keys[i]].set_targets(targets)
-
-		print("# of %s targets: %s" % (tele_keys[i], len(targets)))
-		print("First %s target: %s" % (tele_keys[i], targets[0].name))
-		print("Last %s target: %s" % (tele_keys[i], targets[-1].name))
-
-		obs.schedule_targets(tele_keys[i])
-
-	exit = input("\n\nENTER to exit")
-
-if __name__ == "__main__": main()
-
-		
\ No newline at end of file
+if __name__ == "__main__": sys.exit(main())
@@ -0,0 +1,121 @@
+import heapq
+import logging
+import math
+
+log = logging.getLogger(__name__)
+
+# Real-time dispatch for one telescope and night: instead of a fixed plan, answers "what should we
+# observe now" for the current time. targets need exposures and net priorities computed (see
+# Telescope.compute_exposures/compute_net_priorities); the best target is the one with the lowest
+# net priority -- the order schedule_targets places them in -- that can run its whole block
+# (total_minutes) from now without leaving its observable window.
+#
+# Each observable window gives a target an interval of feasible start steps. Intervals wait in a
+# heap keyed by the step they open; once open they move to a heap keyed by net priority, and
+# entries that are done, skipped or have closed are dropped when they reach its top. Time only
+# moves forward, so next, mark_done and skip are O(log n) amortized.
+class Dispatcher():
+    # done: targets (or names) already observed tonight. skipped: name -> step from which a skipped
+    # target may be offered again (see progress)
+    def __init__(self, observatory, targets, done=(), skipped=None):
+        self.observatory = observatory
+        self.targets = {tgt.name: tgt for tgt in targets}
+        if len(self.targets) < len(targets):
+            raise ValueError("Dispatch needs unique target names!")
+        self.current_step = 0
+        self.done = set()
+        self.skipped_until = {} # tgt -> first step it may be offered again
+        self.latest_start_step = {} # tgt -> last feasible start of the interval it was offered in
+
+        self.waiting = [] # (opens at, net priority, record index, tiebreak, tgt, closes after)
+        self.ready = [] # (net priority, record index, tiebreak, tgt, closes after)
+        self.tiebreak = 0
+
+        done_names = set(d if isinstance(d, str) else d.name for d in done)
+        skipped = skipped or {}
+
+        for tgt in targets:
+            if tgt.name in skipped:
+                self.skipped_until[tgt] = skipped[tgt.name]
+            if tgt.name in done_names:
+                self.done.add(tgt)
+                continue
+            if tgt.total_observable_min <= 0:
+                continue
+
+            num_steps = observatory.minutes_to_steps(tgt.total_minutes)
+            for start, end in tgt.observable_windows:
+                if end - start >= num_steps:
+                    self.wait(tgt, start, end - num_steps)
+
+        heapq.heapify(self.waiting)
+
+    def wait(self, tgt, opens, closes):
+        self.tiebreak += 1
+        heapq.heappush(self.waiting, (opens, tgt.net_priority, tgt.record_index, self.tiebreak, tgt, closes))
+
+    # Time step of the night containing utc_time; times before the night map to step 0 and times
+    # after it to the step past the last
+    def time_to_step(self, utc_time):
+        elapsed = (utc_time - self.observatory.utc_begin_night).total_seconds()
+        return min(max(int(math.floor(elapsed/self.observatory.time_step)), 0), len(self.observatory.utc_time_array))
+
+    # "not started", "observing" or "over" at utc_time
+    def night_status(self, utc_time):
+        elapsed = (utc_time - self.observatory.utc_begin_night).total_seconds()
+        if elapsed < 0:
+            return "not started"
+        if elapsed >= len(self.observatory.utc_time_array)*self.observatory.time_step:
+            return "over"
+        return "observing"
+
+    def advance(self, step):
+        if step < self.current_step:
+            raise ValueError("Dispatch time cannot go backwards (step %s < %s)!" % (step, self.current_step))
+        self.current_step = step
+
+        while len(self.waiting) > 0 and self.waiting[0][0] <= step:
+            opens, net_priority, record_index, tiebreak, tgt, closes = heapq.heappop(self.waiting)
+            heapq.heappush(self.ready, (net_priority, record_index, tiebreak, tgt, closes))
+
+    # Best target to start at utc_time (or the current step), or None. The target stays queued
+    # until it is marked done or skipped.
+    def next(self, utc_time=None):
+        self.advance(self.current_step if utc_time is None else self.time_to_step(utc_time))
+
+        while len(self.ready) > 0:
+            net_priority, record_index, tiebreak, tgt, closes = self.ready[0]
+            if tgt in self.done or closes < self.current_step:
+                heapq.heappop(self.ready)
+            elif self.skipped_until.get(tgt, 0) > self.current_step:
+                heapq.heappop(self.ready)
+                if self.skipped_until[tgt] <= closes:
+                    self.wait(tgt, self.skipped_until[tgt], closes)
+            else:
+                self.latest_start_step[tgt] = closes
+                return tgt
+
+        return None
+
+    def mark_done(self, tgt):
+        self.done.add(tgt)
+        log.debug("%s done at step %s", tgt.name, self.current_step)
+
+    # What has happened tonight, by target name, to carry over to a rebuilt Dispatcher
+    def progress(self):
+        return {
+            "done": [tgt.name for tgt in self.done],
+            "skipped": {tgt.name: until for tgt, until in self.skipped_until.items()},
+            "step": self.current_step
+        }
+
+    # Pass over tgt for the given number of minutes from now, or for the rest of the night (until
+    # the step past the last, which no interval reaches)
+    def skip(self, tgt, minutes=None):
+        until = len(self.observatory.utc_time_array) if minutes is None else self.current_step + self.observatory.minutes_to_steps(minutes)
+        self.skipped_until[tgt] = until
+        log.debug("%s skipped at step %s until %s", tgt.name, self.current_step, until)
+
+    # Last UTC time tgt can be started, in the interval it was last offered in by next
+    def latest_start(self, tgt):
+        return self.observatory.utc_time_array[self.latest_start_step[tgt]]
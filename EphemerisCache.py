@@ -0,0 +1,52 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+# Bump when the layout of the cached arrays changes, so stale files are ignored
+cache_version = 1
+
+# On-disk cache of a night's ephemeris products (twilight bounds and sidereal time axis), stored as
+# one .npz per parameter set. The file name is a hash of every parameter the products depend on, so
+# changing any of them simply misses the cache; the parameters are also stored in the file and
+# checked on load.
+class EphemerisCache():
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def key(self, params):
+        params = dict(params, cache_version=cache_version)
+        return json.dumps(params, sort_keys=True)
+
+    def path(self, params):
+        digest = hashlib.sha1(self.key(params).encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.cache_dir, "%s_%s_%s.npz" % (params["site"], params["date"], digest))
+
+    # Returns a dict of arrays, or None on a miss (or an unreadable/mismatched file)
+    def load(self, params):
+        path = self.path(params)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with np.load(path, allow_pickle=False) as cached:
+                if str(cached["key"]) != self.key(params):
+                    return None
+                return {name: cached[name] for name in cached.files if name != "key"}
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self, params, **arrays):
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # Write to a temporary file and rename, so concurrent runs never read a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".npz")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, key=np.asarray(self.key(params)), **arrays)
+            os.replace(tmp_path, self.path(params))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
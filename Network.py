@@ -0,0 +1,97 @@
+import logging
+
+import numpy as np
+
+from TimeSlots import TimeSlots
+
+log = logging.getLogger(__name__)
+
+# Telescope.compute_net_priorities' score, normalized over the whole network instead of one
+# site: records maps record_index -> {site number: Target view}, and a record's observable time is
+# its longest at any one site (summing over sites would push every record two sites can see behind
+# the ones only one can). Per-site net priorities do not compare across sites; these do.
+# Returns record_index -> network net priority (lower goes first, as at a single site).
+def network_net_priorities(records):
+    priority = {i: next(iter(views.values())).priority for i, views in records.items()}
+    good_time = {i: max(t.total_observable_min for t in views.values()) for i, views in records.items()}
+    exp_time = {i: next(iter(views.values())).total_minutes for i, views in records.items()}
+
+    total_p = sum(priority.values())
+    total_good_time = sum(good_time.values())
+    total_exp_time = sum(exp_time.values())
+    if not (total_p > 0 and total_good_time > 0 and total_exp_time > 0):
+        return {i: 0.0 for i in records}
+
+    scores = {}
+    for i in records:
+        frac_exp_time = 1.0 - float(exp_time[i])/float(total_exp_time)
+        if frac_exp_time == 0.0:
+            frac_exp_time = 1.0
+        scores[i] = float(priority[i])/float(total_p)*float(good_time[i])/float(total_good_time)*frac_exp_time
+    total_prob = sum(scores.values())
+
+    return {i: score/total_prob for i, score in scores.items()}
+
+# Joint allocation of one catalog across several telescopes (sites: list of (Observatory,
+# telescope name), each with its own Target views onto the same catalog records and exposures
+# and net priorities already computed). Records are ranked by their network net priority (see
+# network_net_priorities), then catalog order. Each record in turn is offered to every site where
+# it is observable and goes to the one whose best slot has the lowest mean airmass, repeated until
+# it holds max_telescopes placements or fits nowhere else.
+#
+# Returns record_index -> set of site numbers. The allocation is a plan: each site's own schedule
+# (optimizer and tightening included) can still drop or add targets, so sites are scheduled one at
+# a time with site_targets and their results folded back in with record_placements.
+def allocate_targets(sites, max_telescopes=1, slot_search="prefix"):
+    records = {}
+    for s, (obs, tele_key) in enumerate(sites):
+        for tgt in obs.telescopes[tele_key].get_targets():
+            if tgt.total_observable_min > 0:
+                records.setdefault(tgt.record_index, {})[s] = tgt
+
+    net_priorities = network_net_priorities(records)
+    time_slots = [TimeSlots(len(obs.utc_time_array)) for obs, tele_key in sites]
+    placed = {}
+
+    for index in sorted(records, key=lambda i: (net_priorities[i], i)):
+        placed_at = placed.setdefault(index, set())
+        while len(placed_at) < max_telescopes:
+            best = None
+            for s, tgt in records[index].items():
+                if s in placed_at:
+                    continue
+                obs = sites[s][0]
+                best_indices = obs.slot_finders[slot_search](tgt, obs.minutes_to_steps(tgt.total_minutes), time_slots[s])
+                if best_indices is None:
+                    continue
+                airmass = np.mean(tgt.airmass_segment(best_indices[0], best_indices[-1] + 1))
+                if best is None or airmass < best[0]:
+                    best = (airmass, s, best_indices)
+
+            if best is None:
+                break
+            airmass, s, best_indices = best
+            time_slots[s].reserve(best_indices[0], best_indices[-1] + 1)
+            placed_at.add(s)
+
+    num_placed = sum(1 for placed_at in placed.values() if len(placed_at) > 0)
+    log.info("Network allocation: %s targets placed on %s telescopes, %s placements", \
+             num_placed, len(sites), sum(len(placed_at) for placed_at in placed.values()))
+
+    return placed
+
+# Targets site s may schedule: those placed at fewer than max_telescopes other sites, where
+# placements holds the final placements of the sites already scheduled and the allocated ones of
+# the rest. This keeps the site's allocated targets, in the same order, plus the ones that fit
+# nowhere yet.
+def site_targets(sites, s, placements, max_telescopes):
+    obs, tele_key = sites[s]
+    return [t for t in obs.telescopes[tele_key].get_targets() \
+            if len(placements.get(t.record_index, set()) - {s}) < max_telescopes]
+
+# Replace site s's allocated placements with the targets it actually scheduled
+def record_placements(placements, s, scheduled):
+    for placed_at in placements.values():
+        placed_at.discard(s)
+    for t in scheduled:
+        placements.setdefault(t.record_index, set()).add(s)
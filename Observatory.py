@@ -1,20 +1,68 @@
 import Constants
 import Telescope
 from Utilities import UTC_Offset
+from TimeSlots import TimeSlots, unpack_steps, run_starts
+from EphemerisCache import EphemerisCache
+from Optimizer import LocalSearchOptimizer, target_value
+from RunMetrics import RunMetrics
+from Target import observable_in_night
 
 import ephem
-from dateutil.parser import parse
 from datetime import tzinfo, timedelta, datetime
 import pytz as pytz
 import numpy as np
 import operator
 import copy
-import matplotlib.pyplot as plt
-from matplotlib.pyplot import cm
-import matplotlib.dates as md
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+j2000 = datetime(2000, 1, 1, 12, 0) # UTC
+seconds_per_radian = 86400.0/(2.0*np.pi)
+plot_track_points = 200 # points per full-night airmass track in plots
+sidereal_tolerance = 2.0/seconds_per_radian # radians; ephem reports apparent LST, which may differ by ~1 s
+
+# Local mean sidereal time (radians) for num_steps steps of step_seconds starting at utc_begin, from
+# the IAU 1982 GMST polynomial evaluated over the whole time axis at once
+def compute_sidereal_radians(utc_begin, lon_radians, num_steps, step_seconds=60):
+    days = (utc_begin - j2000).total_seconds()/86400.0 + np.arange(num_steps)*step_seconds/86400.0
+    centuries = days/36525.0
+    gmst_degrees = 280.46061837 + 360.98564736629*days + 0.000387933*centuries**2 - centuries**3/38710000.0
+
+    return np.mod(np.radians(gmst_degrees) + float(lon_radians), 2.0*np.pi)
+
+# "YYYYMMDD" (or anything dateutil understands) at UTC noon
+def parse_obs_date(obs_date_str):
+    try:
+        return datetime.strptime(obs_date_str, "%Y%m%d").replace(hour=12)
+    except ValueError:
+        from dateutil.parser import parse
+        return parse("%s 12:00" % obs_date_str)
+
+# A target on the coarse grid of Observatory.coarse_windows: coarse step c covers fine steps
+# [c*coarse_factor, (c + 1)*coarse_factor), is observable when all of them are, and is scored by
+# the worst airmass among them. Provides what the slot searches use of a Target.
+class CoarseTarget():
+    def __init__(self, tgt, coarse_factor, length_of_night):
+        self.tgt = tgt
+        self.coarse_factor = coarse_factor
+        self.length_of_night = length_of_night
+
+        num_coarse = -(-length_of_night//coarse_factor)
+        self.observable_windows = []
+        for start, end in tgt.observable_windows:
+            start, end = -(-start//coarse_factor), (num_coarse if end >= length_of_night else end//coarse_factor)
+            if end > start:
+                self.observable_windows.append((start, end))
+
+    def airmass_segment(self, start, end):
+        airmass_array = self.tgt.airmass_segment(start*self.coarse_factor, min(end*self.coarse_factor, self.length_of_night))
+        return np.maximum.reduceat(airmass_array, np.arange(0, len(airmass_array), self.coarse_factor))
 
 class Observatory():
-    def __init__(self, name, lon, lat, elevation, horizon, telescopes, obs_date_str, utc_offset, utc_offset_name):        
+    def __init__(self, name, lon, lat, elevation, horizon, telescopes, obs_date_str, utc_offset, utc_offset_name, \
+                 cache_dir=None, time_step=60, plot_dpi=300, plot_legend=True):
         
         self.name = name
         self.ephemeris = ephem.Observer()
@@ -23,14 +71,49 @@ class Observatory():
         self.ephemeris.elevation = elevation
         self.ephemeris.horizon = horizon
         self.telescopes = telescopes
+        self.time_step = time_step # seconds per element of the time axis
+
+        self.plot_dpi = plot_dpi
+        self.plot_legend = plot_legend
+        self.plot_executor = None # background plot rendering, see plot_results
+        self.pending_plots = []
+
+        # Per-telescope scheduling state, filled in by schedule_targets
+        self.schedules = {}
+
+        # Slot search engines used by schedule_targets
+        self.slot_finders = {
+            "greedy": self.find_slot_greedy,
+            "prefix": self.find_slot_prefix,
+            "packed": self.find_slot_packed
+        }
         
         self.obs_date_string = obs_date_str
-        obs_date = parse("%s 12:00" % obs_date_str) # UTC Noon
+        obs_date = parse_obs_date(obs_date_str) # UTC Noon
         self.obs_date = obs_date
         self.ephemeris.date = (self.obs_date - timedelta(hours=utc_offset)) # Local Noon n UTC
 
-        self.utc_begin_night = self.ephemeris.next_setting(ephem.Sun(), use_center=True).datetime()
-        self.utc_end_night = self.ephemeris.next_rising(ephem.Sun(), use_center=True).datetime()
+        # Twilight and sidereal time depend only on these, so they can be reused across runs
+        cache = EphemerisCache(cache_dir) if cache_dir is not None else None
+        cache_params = {
+            "site": self.name,
+            "lon": float(self.ephemeris.lon),
+            "lat": float(self.ephemeris.lat),
+            "elevation": float(self.ephemeris.elevation),
+            "horizon": float(self.ephemeris.horizon),
+            "date": self.obs_date_string,
+            "utc_offset": utc_offset,
+            "seconds_per_step": time_step,
+            "ephem_version": ephem.__version__
+        }
+        cached = cache.load(cache_params) if cache is not None else None
+
+        if cached is not None:
+            self.utc_begin_night = cached["utc_begin_night"].item()
+            self.utc_end_night = cached["utc_end_night"].item()
+        else:
+            self.utc_begin_night = self.ephemeris.next_setting(ephem.Sun(), use_center=True).datetime()
+            self.utc_end_night = self.ephemeris.next_rising(ephem.Sun(), use_center=True).datetime()
         
         self.local_begin_night = pytz.utc.localize(self.utc_begin_night) \
                                  .astimezone(UTC_Offset(utc_offset,utc_offset_name))
@@ -38,31 +121,67 @@ class Observatory():
                                    .astimezone(UTC_Offset(utc_offset,utc_offset_name))
         
         timeDiff = self.local_end_night - self.local_begin_night
-        self.length_of_night = int(round(timeDiff.total_seconds() / 60))
+        self.num_time_steps = int(round(timeDiff.total_seconds() / time_step))
+        self.length_of_night = self.num_time_steps*time_step/60.0 # Minutes covered by the time steps
 
-        self.utc_time_array = np.asarray([self.utc_begin_night + timedelta(minutes=minute) \
-                                          for minute in range(self.length_of_night)])
-        
-        self.local_time_array = np.asarray([self.local_begin_night + timedelta(minutes=minute) \
-                                      for minute in range(self.length_of_night)])
-    
-        self.sidereal_string_array = []
-        self.sidereal_radian_array = []
-        
-        for utc_time in self.utc_time_array:
-            self.ephemeris.date = utc_time
-            st = self.ephemeris.sidereal_time()
+        # Offsets of each time step from the start of the night, as datetime.timedelta objects
+        step_offsets = (np.arange(self.num_time_steps)*time_step).astype('timedelta64[s]').astype(object)
+        self.utc_time_array = self.utc_begin_night + step_offsets
+        self.local_time_array = self.local_begin_night + step_offsets
 
-            tokens = str(st).split(":")
-            float_tokens = [float(t) for t in tokens]
-            st_string = "%02d:%02d:%02d" % (float_tokens[0],float_tokens[1],float_tokens[2])
+        if cached is not None:
+            self.sidereal_radian_array = cached["sidereal_radian_array"]
+        else:
+            self.sidereal_radian_array = compute_sidereal_radians(self.utc_begin_night, self.ephemeris.lon, \
+                                                                  self.num_time_steps, time_step)
+            self.check_sidereal_radians()
 
-            self.sidereal_string_array.append(st_string)
-            self.sidereal_radian_array.append(st)
-        
-        print("%s - %s deg Twilight Ends: %s" % (self.name, np.abs(self.ephemeris.horizon), self.local_begin_night))
-        print("%s - %s deg Dawn Begins: %s" % (self.name, np.abs(self.ephemeris.horizon), self.local_end_night))
-        print(self.local_time_array)
+            if cache is not None:
+                cache.save(cache_params,
+                           utc_begin_night=np.datetime64(self.utc_begin_night, 'us'),
+                           utc_end_night=np.datetime64(self.utc_end_night, 'us'),
+                           sidereal_radian_array=self.sidereal_radian_array)
+
+        log.info("%s - %s deg Twilight Ends: %s", self.name, np.abs(self.ephemeris.horizon), self.local_begin_night)
+        log.info("%s - %s deg Dawn Begins: %s", self.name, np.abs(self.ephemeris.horizon), self.local_end_night)
+        log.debug("%s time steps of %s s from %s to %s", self.num_time_steps, time_step, self.local_time_array[0], self.local_time_array[-1])
+
+    # Prefilter for a catalog (Utilities.catalog_dtype records) at this site, before any airmass is
+    # computed. Returns (records that reach the airmass limit tonight, their catalog positions,
+    # names of the rejected records).
+    def select_observable(self, catalog):
+        observable = observable_in_night(catalog["ra"], catalog["dec"], self.ephemeris.lat, \
+                                         self.sidereal_radian_array, Constants.airmass_threshold)
+        rejected = catalog["name"][~observable]
+
+        if len(rejected) > 0:
+            log.info("%s: %s of %s targets never reach airmass %s tonight", self.name, len(rejected), len(catalog), \
+                     Constants.airmass_threshold)
+            log.debug("%s rejected: %s", self.name, ", ".join(rejected))
+
+        return catalog[observable], np.flatnonzero(observable), list(rejected)
+
+    # Spot-check the analytic LST axis against ephem at the start and end of the night
+    def check_sidereal_radians(self):
+        for index in [0, len(self.utc_time_array) - 1]:
+            self.ephemeris.date = self.utc_time_array[index]
+            delta = np.angle(np.exp(1j*(self.sidereal_radian_array[index] - self.ephemeris.sidereal_time())))
+            if np.abs(delta) > sidereal_tolerance:
+                raise ValueError("%s: analytic LST differs from ephem by %0.2f s at %s" % \
+                                 (self.name, delta*seconds_per_radian, self.utc_time_array[index]))
+
+    # "HH:MM:SS" LST labels, built only for the requested indices (e.g. plot ticks)
+    def sidereal_strings(self, indices):
+        hours = (np.asarray(self.sidereal_radian_array)[indices]*seconds_per_radian/3600.0) % 24.0
+        labels = []
+        for h in hours:
+            total_seconds = int(h*3600)
+            labels.append("%02d:%02d:%02d" % (total_seconds // 3600, (total_seconds % 3600) // 60, total_seconds % 60))
+        return labels
+
+    # Number of time steps needed to cover an observation of the given length
+    def minutes_to_steps(self, minutes):
+        return int(np.ceil(minutes*60.0/self.time_step - 1e-9))
 
     def is_contiguous(self, int_array):
         i = iter(int_array)
@@ -70,112 +189,645 @@ class Observatory():
         contiguous = all(a == b for a, b in enumerate(i, first + 1))
         return contiguous
 
-    def schedule_targets(self, telescope_name):
+    # Free, observable ranges in [lo, hi) where tgt could hold a block of k steps: each observable
+    # window, clipped to [lo, hi), intersected with the free gaps of at least k steps. Slot searches
+    # only evaluate airmass inside these ranges.
+    def candidate_ranges(self, tgt, k, time_slots, lo=0, hi=None):
+        hi = len(self.utc_time_array) if hi is None else hi
+        ranges = []
+        for start, end in tgt.observable_windows:
+            start, end = max(start, lo), min(end, hi)
+            if end - start >= k:
+                ranges.extend(time_slots.gaps(k, start, end))
+
+        return ranges
+
+    # Reference slot search: crawl forward over the free, observable time steps in [lo, hi), grabbing
+    # segments of length num_steps. Returns the indices of the contiguous segment with the smallest
+    # integrated airmass, or None if nothing fits.
+    def find_slot_greedy(self, tgt, num_steps, time_slots, lo=0, hi=None):
+        if num_steps <= 0:
+            return None
+
+        best_indices = None
+        largest_airmass = 1e+6
+
+        # We are crawling forward along each range, grabbing segments of length "num_steps",
+        # and incrementing in starting index
+        for range_start, range_end in self.candidate_ranges(tgt, num_steps, time_slots, lo, hi):
+            airmass_array = tgt.airmass_segment(range_start, range_end)
+            for i in range(range_end - range_start - num_steps + 1):
+                # Compute the integrated airmass. We're looking for the smallest # => the best conditions
+                integrated_am = np.sum(airmass_array[i:i + num_steps])
+
+                # if this is the smallest, it's the new one to beat
+                if integrated_am < largest_airmass:
+                    largest_airmass = integrated_am
+                    best_indices = np.arange(range_start + i, range_start + i + num_steps)
+
+        return best_indices
+
+    # Same placements as find_slot_greedy, but every segment inside a range is scored in one pass
+    # from a prefix sum of its airmass.
+    def find_slot_prefix(self, tgt, num_steps, time_slots, lo=0, hi=None):
+        k = int(num_steps)
+        if k <= 0:
+            return None
+
+        starts = []
+        integrated_am = []
+        for range_start, range_end in self.candidate_ranges(tgt, k, time_slots, lo, hi):
+            airmass_sum = np.concatenate(([0.0], np.cumsum(tgt.airmass_segment(range_start, range_end))))
+            starts.append(np.arange(range_start, range_end - k + 1))
+            integrated_am.append(airmass_sum[k:] - airmass_sum[:-k])
+
+        starts = np.concatenate([np.empty(0, dtype=int)] + starts)
+        integrated_am = np.concatenate([np.empty(0)] + integrated_am)
+
+        return self.best_window(tgt, k, starts, integrated_am)
+
+    # Same placements again, with feasibility worked out on packed bit masks (see TimeSlots): the
+    # free steps inside the target's observable windows, clipped to [lo, hi), are set as bits, and
+    # runs of num_steps set bits give the candidate starts. Airmass is only evaluated for the blocks those
+    # starts cover, one segment per run of consecutive starts.
+    def find_slot_packed(self, tgt, num_steps, time_slots, lo=0, hi=None):
+        k = int(num_steps)
+        if k <= 0:
+            return None
+
+        n = len(self.utc_time_array)
+        hi = n if hi is None else hi
+        bits = 0
+        for start, end in tgt.observable_windows:
+            bits |= time_slots.free_bits(max(start, lo), min(end, hi))
+        starts = np.flatnonzero(unpack_steps(run_starts(bits, k), n))
+        if len(starts) == 0:
+            return None
+
+        integrated_am = []
+        for run in np.split(starts, np.flatnonzero(np.diff(starts) > 1) + 1):
+            airmass_sum = np.concatenate(([0.0], np.cumsum(tgt.airmass_segment(run[0], run[-1] + k))))
+            integrated_am.append(airmass_sum[k:] - airmass_sum[:-k])
+
+        return self.best_window(tgt, k, starts, np.concatenate(integrated_am))
+
+    # Indices of the lowest integrated airmass segment among candidate starts, or None
+    def best_window(self, tgt, k, starts, integrated_am):
+        if len(starts) == 0:
+            return None
+
+        # Prefix sums round differently than np.sum, so settle near-ties with the exact sum the
+        # greedy search uses; argmin keeps the earliest start, as the greedy search does
+        ties = starts[integrated_am <= integrated_am.min() + 1e-9*k]
+        exact_am = [np.sum(tgt.airmass_segment(t, t + k)) for t in ties]
+        best_start = ties[int(np.argmin(exact_am))]
+
+        return np.arange(best_start, best_start + k)
+
+    # Coarse pass for two-phase scheduling: place the targets on a grid coarse_factor times coarser
+    # (see CoarseTarget), and return for each target the fine-grid window [lo, hi) around its coarse
+    # placement, or None if it did not fit on the coarse grid.
+    def coarse_windows(self, targets, find_slot, coarse_factor):
+        n = len(self.utc_time_array)
+        coarse_slots = TimeSlots(int(np.ceil(n/float(coarse_factor))))
+        windows = []
+
+        for tgt in targets:
+            if tgt.total_observable_min <= 0:
+                windows.append(None)
+                continue
+
+            num_steps = int(np.ceil(self.minutes_to_steps(tgt.total_minutes)/float(coarse_factor)))
+            coarse_indices = find_slot(CoarseTarget(tgt, coarse_factor, n), num_steps, coarse_slots)
+
+            if coarse_indices is None:
+                windows.append(None)
+                continue
+
+            coarse_slots.reserve(coarse_indices[0], coarse_indices[-1] + 1)
+            # Allow one coarse step of slack on either side for the fine search
+            lo = max(0, (coarse_indices[0] - 1)*coarse_factor)
+            hi = min(n, (coarse_indices[-1] + 2)*coarse_factor)
+            windows.append((lo, hi))
+
+        return windows
+
+    # Reserve best_indices for tgt and record its placement
+    def assign_slot(self, tgt, best_indices, time_slots):
+        time_slots.reserve(best_indices[0], best_indices[-1] + 1) # reserve these slots
+
+        # grab the corresponding
+        tgt.scheduled_airmass_array = tgt.airmass_segment(best_indices[0], best_indices[-1] + 1)
+        tgt.scheduled_time_array = np.asarray(self.local_time_array)[best_indices]
+        tgt.starting_index = best_indices[0]
+
+    # Steps before consumed_steps are in the past, so they stay reserved
+    def unassign_slot(self, tgt, time_slots, consumed_steps=0):
+        start = max(tgt.starting_index, consumed_steps)
+        end = tgt.starting_index + len(tgt.scheduled_time_array)
+        if start < end:
+            time_slots.release(start, end)
+
+        tgt.scheduled_airmass_array = None
+        tgt.scheduled_time_array = None
+        tgt.starting_index = 0
+
+    # metrics: optional RunMetrics to record into (e.g. with the caller's own stages); the run
+    # report is written next to the schedule CSV. precomputed: exposures and net priorities have
+    # already been computed for the telescope's targets (e.g. by a network allocation). archive:
+    # optional ScheduleArchive the night's placements are appended to. tighten: run tighten_schedule
+    # after placement
+    def schedule_targets(self, telescope_name, slot_search="prefix", coarse_factor=None, optimize_seconds=None, plot=True, show_plot=True, \
+                         metrics=None, precomputed=False, archive=None, tighten=False):
+        telescope = self.telescopes[telescope_name]
+        if metrics is None:
+            metrics = RunMetrics()
+        metrics.info.update(observatory=self.name, telescope=telescope_name, date=self.obs_date_string, \
+                            slot_search=slot_search, time_step=self.time_step)
         
         # Update internal Target list with priorities and exposures
-        telescope = self.telescopes[telescope_name]
-        telescope.compute_exposures()
-        telescope.compute_net_priorities()
-        targets = telescope.get_targets()
+        if not precomputed:
+            with metrics.stage("compute_exposures"):
+                telescope.compute_exposures()
+            with metrics.stage("compute_net_priorities"):
+                telescope.compute_net_priorities()
+
+        with metrics.stage("place_targets"):
+            o, bad_o = self.place_targets(telescope_name, slot_search, coarse_factor, optimize_seconds, metrics, tighten)
+
+        # The operator's CSV comes first; the plot is not on the critical path
+        with metrics.stage("write_schedule"):
+            telescope.write_schedule(self.name, self.obs_date, o, archive)
+
+        scheduled_minutes = sum(self.block_minutes(t) for t in o)
+        budgeted_overheads = sum(60*self.block_minutes(t) - sum(t.exposures.values()) for t in o)
+        metrics.set("scheduled_minutes", scheduled_minutes)
+        metrics.set("night_minutes", self.length_of_night)
+        metrics.set("open_shutter_percent", round(100.0*scheduled_minutes/self.length_of_night, 2))
+        metrics.set("modeled_overhead_minutes", round(telescope.sequence_dead_time(o)/60.0, 2))
+        metrics.set("budgeted_overhead_minutes", round(budgeted_overheads/60.0, 2))
+        log.info("%s %s: %s scheduled, %s unfit, %s unobservable; Open Shutter Time: %0.2f%%", self.name, telescope_name, \
+                 metrics.counters.get("placed", 0), metrics.counters.get("unfit", 0), metrics.counters.get("unobservable", 0), \
+                 metrics.values["open_shutter_percent"])
+
+        if plot:
+            with metrics.stage("plot_results"):
+                self.plot_results(o, telescope_name, show_plot)
+
+        report_file = telescope.report_file_name(self.name, self.obs_date)
+        metrics.write(report_file)
+        log.info("Wrote %s", report_file)
+
+        return o, bad_o
+
+    # Place a telescope's targets (exposures and net priorities already computed) in net priority
+    # order. Returns (scheduled in time order, unfit).
+    def place_targets(self, telescope_name, slot_search="prefix", coarse_factor=None, optimize_seconds=None, metrics=None, tighten=False):
+        metrics = RunMetrics() if metrics is None else metrics
+        targets = self.telescopes[telescope_name].get_targets()
+        find_slot = self.slot_finders[slot_search]
 
         # Sorted by priority and closeness to discovery
         targets.sort(key = operator.attrgetter('net_priority')) # 'TotalGoodAirMass'
-        length_of_night = len(self.utc_time_array) # In minutes
+        length_of_night = len(self.utc_time_array) # In time steps
         
-        for tgt in targets:
-            print("%s: %s; %s min; Pri: %s" % (tgt.name, tgt.exposures, tgt.total_minutes, tgt.priority))
+        if log.isEnabledFor(logging.DEBUG):
+            for tgt in targets:
+                log.debug("%s: %s; %s min; Pri: %s", tgt.name, tgt.exposures, tgt.total_minutes, tgt.priority)
+
+        # Two-phase mode: the fine search is confined to the window each target got on the coarse grid
+        if coarse_factor is not None and coarse_factor > 1:
+            with metrics.stage("coarse_windows"):
+                windows = self.coarse_windows(targets, find_slot, coarse_factor)
+        else:
+            windows = [None]*len(targets)
 
-        time_slots = np.zeros(length_of_night)
+        time_slots = TimeSlots(length_of_night)
         o = []
         bad_o = []
+        unobservable = []
 
-        for tgt in targets:
+        for tgt, window in zip(targets, windows):
+
+            if tgt.total_observable_min <= 0:
+                log.debug("%s is unobservable!", tgt.name)
+                unobservable.append(tgt)
+                continue
+
+            num_steps = self.minutes_to_steps(tgt.total_minutes)
+            best_indices = None
+            if window is not None:
+                metrics.count("slot_searches")
+                best_indices = find_slot(tgt, num_steps, time_slots, *window)
+
+            # No (or no usable) coarse window: search the whole night at full resolution
+            if best_indices is None:
+                metrics.count("slot_searches")
+                best_indices = find_slot(tgt, num_steps, time_slots)
+
+            if best_indices is not None:
+                self.assign_slot(tgt, best_indices, time_slots)
+                o.append(tgt)
+            else:
+                log.debug("Can't fit %s. Skipping!", tgt.name)
+                bad_o.append(tgt)
+
+        optimizer_report = None
+        if optimize_seconds is not None and optimize_seconds > 0:
+            with metrics.stage("optimize"):
+                o, bad_o, optimizer_report = self.optimize_schedule(o, bad_o, time_slots, find_slot, optimize_seconds)
+            metrics.set("optimizer", optimizer_report)
 
-            gam1 = copy.deepcopy(tgt.raw_airmass_array)
-            gam2 = copy.deepcopy(tgt.raw_airmass_array)
-            found = False
+        if tighten:
+            with metrics.stage("tighten"):
+                o, bad_o, tighten_report = self.tighten_schedule(telescope_name, o, bad_o, time_slots, find_slot)
+            metrics.set("tighten", tighten_report)
 
-            while not found:
+        metrics.count("placed", len(o))
+        metrics.count("unfit", len(bad_o))
+        metrics.count("unobservable", len(unobservable))
+
+        # Kept so the schedule can be repaired in place (see add_targets and friends)
+        self.schedules[telescope_name] = {
+            "time_slots": time_slots,
+            "find_slot": find_slot,
+            "scheduled": o,
+            "unscheduled": bad_o + unobservable,
+            "consumed_steps": 0,
+            "optimizer_report": optimizer_report
+        }
+
+
+        o.sort(key = operator.attrgetter('starting_index'))
+        return o, bad_o
+
+    # Improve a greedy schedule with the time-budgeted local search in Optimizer.py, then move the
+    # targets to the best placements it found. Returns the new (scheduled, unscheduled) lists and the
+    # optimizer's report.
+    def optimize_schedule(self, o, bad_o, time_slots, find_slot, time_budget, seed=None):
+        optimizer = LocalSearchOptimizer(self, find_slot, seed)
+        placements, report = optimizer.run(o, bad_o, time_slots, time_budget)
+
+        log.info("Optimizer: priority-weighted minutes %0.2f -> %0.2f (%+0.2f%%), %s moves (%s accepted) in %0.2f s", \
+                 report["greedy_score"], report["optimized_score"], report["improvement_percent"], \
+                 report["iterations"], report["accepted_moves"], report["seconds"])
+
+        for tgt in o:
+            self.unassign_slot(tgt, time_slots)
+
+        scheduled = []
+        for tgt, start in sorted(placements.items(), key=lambda item: item[1]):
+            self.assign_slot(tgt, np.arange(start, start + self.minutes_to_steps(tgt.total_minutes)), time_slots)
+            scheduled.append(tgt)
+
+        return scheduled, [t for t in o + bad_o if t not in placements], report
+
+    # Whether tgt stays within the airmass cutoff over [start, end)
+    def fits_window(self, tgt, start, end):
+        return any(s <= start and end <= e for s, e in tgt.observable_windows)
+
+    # Steps tgt's block needs when the telescope comes to it from previous (None: a nominal slew)
+    # with last_filter in place. Returns (steps, the filter it ends on).
+    def block_steps(self, telescope, tgt, previous, last_filter):
+        slew_deg = telescope.nominal_slew_deg if previous is None else Telescope.angular_separation(previous, tgt)
+        sequence = telescope.filter_sequence(tgt.exposures, last_filter)
+        seconds = telescope.sequence_block_seconds(tgt.exposures, sequence, last_filter, slew_deg)
+        return self.minutes_to_steps(seconds/60.0), sequence[-1] if len(sequence) > 0 else last_filter
+
+    # Length of tgt's placed block; differs from total_minutes once the block is re-sized for its
+    # actual slew (see tighten_schedule)
+    def block_minutes(self, tgt):
+        return len(tgt.scheduled_time_array)*self.time_step/60.0
+
+    def move_block(self, tgt, start, num_steps, time_slots):
+        self.unassign_slot(tgt, time_slots)
+        self.assign_slot(tgt, np.arange(start, start + num_steps), time_slots)
+
+    # Optional post-placement pass over the overhead model (schedule_targets(tighten=True)). Blocks
+    # are placed with a nominal slew; once the order is known this
+    #  1. swaps back-to-back neighbours when both stay in their observable windows, their summed
+    #     integrated airmass gets no worse and the modeled dead time around them
+    #     (Telescope.sequence_dead_time) goes down,
+    #  2. re-sizes every block for the actual slew and filter changes from the block before it,
+    #     releasing the surplus, or growing into free, observable time on either side; a block that
+    #     cannot grow in place moves to the best slot of its required length, and if there is none it
+    #     stays as it is and is counted in overrun_steps -- no placed target is ever dropped,
+    #  3. moves a block up against its predecessor when its integrated airmass gets no worse there,
+    #  4. offers the freed time to the unscheduled targets, in net priority order,
+    # repeating 2-4 while blocks are moved or targets added. Blocks starting before consumed_steps are
+    # left alone. Returns (scheduled, unscheduled, report), with the modeled dead time before and after.
+    def tighten_schedule(self, telescope_name, scheduled, unscheduled, time_slots, find_slot, consumed_steps=0, max_rounds=5):
+        telescope = self.telescopes[telescope_name]
+        order = sorted(scheduled, key = operator.attrgetter('starting_index'))
+        unscheduled = sorted(unscheduled, key = operator.attrgetter('net_priority'))
+        report = {"swaps": 0, "released_steps": 0, "relocated": 0, "overrun_steps": 0, "added": 0, \
+                  "dead_time_before_min": round(float(telescope.sequence_dead_time(order))/60.0, 2)}
+
+        swapped = True
+        while swapped:
+            swapped = False
+            for i in range(len(order) - 1):
+                a, b = order[i], order[i + 1]
+                start, a_steps, b_steps = a.starting_index, len(a.scheduled_time_array), len(b.scheduled_time_array)
+                if start < consumed_steps or b.starting_index != start + a_steps:
+                    continue
+                if not (self.fits_window(b, start, start + b_steps) and self.fits_window(a, start + b_steps, start + b_steps + a_steps)):
+                    continue
+                swapped_airmass = np.sum(b.airmass_segment(start, start + b_steps)) + \
+                                  np.sum(a.airmass_segment(start + b_steps, start + b_steps + a_steps))
+                if swapped_airmass > np.sum(a.scheduled_airmass_array) + np.sum(b.scheduled_airmass_array):
+                    continue
+
+                neighbours = order[max(0, i - 1):i + 3]
+                trial = [b if t is a else a if t is b else t for t in neighbours]
+                if telescope.sequence_dead_time(trial) < telescope.sequence_dead_time(neighbours) - 1e-6:
+                    self.unassign_slot(b, time_slots)
+                    self.move_block(a, start + b_steps, a_steps, time_slots)
+                    self.assign_slot(b, np.arange(start, start + b_steps), time_slots)
+                    order[i], order[i + 1] = b, a
+                    report["swaps"] += 1
+                    swapped = True
+
+        for round_number in range(max_rounds):
+            report["overrun_steps"] = 0
+            relocated = []
+            previous = None
+            last_filter = telescope.filter_order[0]
+            for tgt in order:
+                start, have = tgt.starting_index, len(tgt.scheduled_time_array)
+                need, last_filter = self.block_steps(telescope, tgt, previous, last_filter)
+                if start >= consumed_steps:
+                    if need < have:
+                        self.move_block(tgt, start, need, time_slots)
+                        report["released_steps"] += have - need
+                    elif need > have:
+                        earlier = start + have - need
+                        if time_slots.is_free(start + have, start + need) and self.fits_window(tgt, start, start + need):
+                            self.move_block(tgt, start, need, time_slots)
+                        elif earlier >= consumed_steps and time_slots.is_free(earlier, start) and self.fits_window(tgt, earlier, start + have):
+                            self.move_block(tgt, earlier, need, time_slots)
+                        else:
+                            self.unassign_slot(tgt, time_slots)
+                            best_indices = find_slot(tgt, need, time_slots, consumed_steps)
+                            if best_indices is not None:
+                                self.assign_slot(tgt, best_indices, time_slots)
+                                relocated.append(tgt)
+                                continue
+                            self.assign_slot(tgt, np.arange(start, start + have), time_slots)
+                            report["overrun_steps"] += need - have
+
+                    earliest = consumed_steps if previous is None else max(consumed_steps, previous.starting_index + len(previous.scheduled_time_array))
+                    steps = len(tgt.scheduled_time_array)
+                    if earliest < tgt.starting_index and time_slots.is_free(earliest, tgt.starting_index) and \
+                       self.fits_window(tgt, earliest, earliest + steps) and \
+                       np.sum(tgt.airmass_segment(earliest, earliest + steps)) <= np.sum(tgt.scheduled_airmass_array):
+                        self.move_block(tgt, earliest, steps, time_slots)
+                previous = tgt
+
+            report["relocated"] += len(relocated)
+            order.sort(key = operator.attrgetter('starting_index'))
+            if round_number == max_rounds - 1:
+                break
+
+            added = []
+            for tgt in unscheduled:
                 if tgt.total_observable_min <= 0:
-                    print("%s is unobservable!" % tgt.name)
-                    break
-
-                gam2[np.where(time_slots == 1)] = 8888 # make different than airmass cutoff flag
-                goodtime = np.where(gam2 <= Constants.airmass_threshold)
-                n = len(goodtime[0])
-
-                current_start = -1 # So that iterator below starts at 0, the first index
-                best_indices = []
-                largest_airmass = 1e+6
-
-                # We are crawling forward along the array, grabbing segments of length "total_min", 
-                # and incrementing in starting index
-                for i in range(n):
-                    current_start += 1 # start index
-                    end = (current_start + tgt.total_minutes) # how many
-                    candidate_indices = goodtime[0][current_start:end] # array of selected indices
-
-                    if len(candidate_indices) != tgt.total_minutes: # If this is at the end of the array, it won't be the size we need
-        #                 print("%s: can't fit %s exp time in slot of size %s " % \
-        #                       (obj.Name, obj.TotalMinutes, len(candidate_indices)))
-        #                 print(candidate_indices)
-                        continue
-                    else:
-                        # Compute the integrated airmass. We're looking for the smallest # => the best conditions
-                        integrated_am = np.sum(gam1[candidate_indices])
-
-                        # Check if this associated integrated airmass corresponds to a range of time that's contiguous
-                        contiguous = self.is_contiguous(candidate_indices)
-
-                        # if this is the smallest, and is for a contiguous span of time, it's the new one to beat
-                        if integrated_am < largest_airmass and contiguous:
-                            largest_airmass = integrated_am
-                            best_indices = candidate_indices
-                            
-                if largest_airmass < 1e+6:
-                    
-                    found = True
-                    time_slots[best_indices] = 1 # reserve these slots
-
-                    # grab the corresponding
-                    tgt.scheduled_airmass_array = np.asarray(tgt.raw_airmass_array)[best_indices]
-                    tgt.scheduled_time_array = np.asarray(self.local_time_array)[best_indices]
-                    tgt.starting_index = best_indices[0]
-
-                    o.append(tgt)
-                else:
-                    print("Can't fit %s. Skipping!" % tgt.name)
-                    bad_o.append(tgt)
-                    break
-        
-        self.plot_results(o, telescope_name)
-        telescope.write_schedule(self.name, self.obs_date ,o)
+                    continue
+                best_indices = find_slot(tgt, self.minutes_to_steps(tgt.total_minutes), time_slots, consumed_steps)
+                if best_indices is not None:
+                    self.assign_slot(tgt, best_indices, time_slots)
+                    added.append(tgt)
+
+            if len(added) == 0 and len(relocated) == 0:
+                break
+            report["added"] += len(added)
+            unscheduled = [t for t in unscheduled if t not in added]
+            order = sorted(order + added, key = operator.attrgetter('starting_index'))
+
+        report["dead_time_after_min"] = round(float(telescope.sequence_dead_time(order))/60.0, 2)
+        log.info("Tightened %s: modeled dead time %s -> %s min; %s swaps, %s steps released, %s blocks moved, %s targets added, "
+                 "%s steps over budget", telescope_name, report["dead_time_before_min"], report["dead_time_after_min"], \
+                 report["swaps"], report["released_steps"], report["relocated"], report["added"], report["overrun_steps"])
+        return order, unscheduled, report
+
+    # Incremental re-scheduling. After schedule_targets has run for a telescope, the methods below
+    # change its target list or the time still available and then call repair_schedule, which keeps
+    # every existing placement and only tries to place the targets that are currently unscheduled.
+    # Returns (scheduled, unscheduled); use write_current_schedule to re-emit the CSV.
+
+    def add_targets(self, telescope_name, new_targets):
+        telescope = self.telescopes[telescope_name]
+        telescope.set_targets(telescope.get_targets() + list(new_targets))
+        telescope.compute_exposures(new_targets)
+        telescope.compute_net_priorities()
+
+        self.schedules[telescope_name]["unscheduled"].extend(new_targets)
+        return self.repair_schedule(telescope_name)
+
+    def remove_targets(self, telescope_name, names):
+        names = set(names)
+        state = self.schedules[telescope_name]
+        telescope = self.telescopes[telescope_name]
+
+        # A target that has already started keeps the time it used; only the rest is freed
+        for tgt in state["scheduled"]:
+            if tgt.name in names:
+                self.unassign_slot(tgt, state["time_slots"], state["consumed_steps"])
+
+        state["scheduled"] = [t for t in state["scheduled"] if t.name not in names]
+        state["unscheduled"] = [t for t in state["unscheduled"] if t.name not in names]
+        telescope.set_targets([t for t in telescope.get_targets() if t.name not in names])
+        telescope.compute_net_priorities()
+
+        return self.repair_schedule(telescope_name)
+
+    # priorities: dict of target name -> new (natural) priority
+    def update_priorities(self, telescope_name, priorities):
+        telescope = self.telescopes[telescope_name]
+        for tgt in telescope.get_targets():
+            if tgt.name in priorities:
+                tgt.priority = priorities[tgt.name]
+        telescope.compute_net_priorities()
+
+        return self.repair_schedule(telescope_name)
+
+    # Mark the night up to utc_time as used: nothing new is placed before it, and targets that
+    # have already started are no longer moved or pre-empted
+    def consume_time(self, telescope_name, utc_time):
+        state = self.schedules[telescope_name]
+        time_slots = state["time_slots"]
+        elapsed = (utc_time - self.utc_begin_night).total_seconds()
+        consumed_steps = min(len(self.utc_time_array), max(0, int(np.ceil(elapsed/self.time_step))))
+
+        for gap_start, gap_end in time_slots.gaps(1, 0, consumed_steps):
+            time_slots.reserve(gap_start, gap_end)
+        state["consumed_steps"] = max(state["consumed_steps"], consumed_steps)
+
+        return self.repair_schedule(telescope_name)
+
+    # Try to place each unscheduled target, best net priority first. A target that does not fit
+    # may pre-empt not-yet-started targets of worse net priority (see preempt_slot), which then
+    # rejoin the queue.
+    def repair_schedule(self, telescope_name):
+        state = self.schedules[telescope_name]
+        time_slots = state["time_slots"]
+        find_slot = state["find_slot"]
+
+        pending = sorted(state["unscheduled"], key = operator.attrgetter('net_priority'))
+        state["unscheduled"] = []
+
+        while len(pending) > 0:
+            tgt = pending.pop(0)
+            if tgt.total_observable_min <= 0:
+                state["unscheduled"].append(tgt)
+                continue
+
+            num_steps = self.minutes_to_steps(tgt.total_minutes)
+            best_indices = find_slot(tgt, num_steps, time_slots)
+            evicted = []
+
+            if best_indices is None:
+                best_indices, evicted = self.preempt_slot(tgt, num_steps, state)
+
+            if best_indices is None:
+                state["unscheduled"].append(tgt)
+                continue
+
+            for e in evicted:
+                log.info("%s pre-empts %s", tgt.name, e.name)
+                self.unassign_slot(e, time_slots)
+                state["scheduled"].remove(e)
+                pending.append(e)
+            pending.sort(key = operator.attrgetter('net_priority'))
+
+            self.assign_slot(tgt, best_indices, time_slots)
+            state["scheduled"].append(tgt)
+
+        return state["scheduled"], state["unscheduled"]
+
+    # Slot for tgt that pre-empts only not-yet-started targets of worse net priority, worst first:
+    # the fewest of them (binary search over that order) whose removal lets find_slot place tgt.
+    # The targets it would evict must be worth less, together, than tgt (Optimizer.target_value),
+    # so pre-emption never lowers the schedule's priority weight and a cascade of evictions, each
+    # raising it, cannot run away. Returns (indices, targets that overlap them), or (None, []).
+    def preempt_slot(self, tgt, num_steps, state):
+        candidates = [t for t in state["scheduled"] \
+                      if t.net_priority > tgt.net_priority and t.starting_index >= state["consumed_steps"]]
+        candidates.sort(key = operator.attrgetter('net_priority'), reverse=True)
+
+        def trial(num_released):
+            trial_slots = state["time_slots"].copy()
+            for t in candidates[:num_released]:
+                trial_slots.release(t.starting_index, t.starting_index + len(t.scheduled_time_array))
+            return state["find_slot"](tgt, num_steps, trial_slots)
+
+        if len(candidates) == 0 or trial(len(candidates)) is None:
+            return None, []
+
+        lo, hi = 1, len(candidates)
+        while lo < hi:
+            mid = (lo + hi)//2
+            if trial(mid) is None:
+                lo = mid + 1
+            else:
+                hi = mid
+        best_indices = trial(lo)
+
+        start, end = best_indices[0], best_indices[-1] + 1
+        evicted = [t for t in candidates[:lo] \
+                   if t.starting_index < end and start < t.starting_index + len(t.scheduled_time_array)]
+        if sum(target_value(t) for t in evicted) >= target_value(tgt):
+            return None, []
+
+        return best_indices, evicted
+
+    def write_current_schedule(self, telescope_name):
+        scheduled = sorted(self.schedules[telescope_name]["scheduled"], key = operator.attrgetter('starting_index'))
+        self.telescopes[telescope_name].write_schedule(self.name, self.obs_date, scheduled)
         
-    def plot_results(self, good_targets, telescope_name):
-        good_targets.sort(key = operator.attrgetter('starting_index'))
-        length_of_night = len(self.utc_time_array) # in minutes
-        print(len(good_targets))
-        fig = plt.figure(figsize=(10,4))
+    # Everything the plot needs, copied on the calling thread so a background render never sees
+    # targets that are being re-scheduled. Background (full-night) tracks are decimated to about
+    # plot_track_points points each.
+    def plot_data(self, good_targets, telescope_name):
+        good_targets = sorted(good_targets, key = operator.attrgetter('starting_index'))
+        step = max(1, len(self.utc_time_array) // plot_track_points)
+
+        tracks = []
+        for tgt in good_targets:
+            airmass = tgt.airmass_curve(step)
+            tracks.append({
+                "label": "%s\nNat Pri: %s\nNet Pri: %0.5f\n%s min" % (tgt.name, tgt.priority, tgt.net_priority, tgt.total_minutes),
+                "airmass": np.where(airmass > Constants.airmass_threshold + 1.0, np.nan, airmass),
+                "scheduled_time": np.asarray(tgt.scheduled_time_array),
+                "scheduled_airmass": np.asarray(tgt.scheduled_airmass_array)
+            })
+
+        total_tgts = sum(self.block_minutes(tgt) for tgt in good_targets)
+        return {
+            "telescope_name": telescope_name,
+            "track_times": self.local_time_array[::step],
+            "tracks": tracks,
+            "percent": 100*float(total_tgts)/float(self.length_of_night),
+            "file_name": "%s_%s_%s_Plot.png" % (self.name, telescope_name, self.obs_date_string)
+        }
+
+    # With show_plot, draw with pyplot and display (interactive sessions); otherwise render with the
+    # non-interactive Agg backend on a background thread -- see wait_for_plots
+    def plot_results(self, good_targets, telescope_name, show_plot=True):
+        data = self.plot_data(good_targets, telescope_name)
+
+        if show_plot:
+            import matplotlib.pyplot as plt
+            fig = plt.figure(figsize=(10,4))
+            self.render_plot(fig, data)
+            plt.show(block=False)
+        else:
+            if self.plot_executor is None:
+                self.plot_executor = ThreadPoolExecutor(max_workers=1)
+            self.pending_plots.append(self.plot_executor.submit(self.render_background_plot, data))
+
+    def render_background_plot(self, data):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        fig = Figure(figsize=(10,4))
+        FigureCanvasAgg(fig)
+        return self.render_plot(fig, data)
+
+    # Block until background plots are saved; returns their file names
+    def wait_for_plots(self):
+        pending, self.pending_plots = self.pending_plots, []
+        return [f.result() for f in pending]
+
+    def render_plot(self, fig, data):
+        # Deferred so that runs without plots never import matplotlib
+        from matplotlib import cm
+        from matplotlib.collections import LineCollection
+        from matplotlib.lines import Line2D
+        import matplotlib.dates as md
+
+        length_of_night = len(self.utc_time_array) # in time steps
         ax1 = fig.add_subplot(111)
         ax2 = ax1.twiny()
         ax3 = ax1.twiny()
 
         ax1.invert_yaxis()
         ax1.set_ylim([Constants.airmass_threshold,0.8])
-        n = len(good_targets)
-        color=cm.rainbow(np.linspace(0,1,n))
-        c = iter(color)
+        n = len(data["tracks"])
+        colors = cm.rainbow(np.linspace(0,1,n))
 
         ax1.set_ylabel("Relative Air Mass")
         ax1.set_xlabel("Local Time")
         ax1.grid(True)
         ax1.set_axisbelow(True)
+        ax1.xaxis.set_major_formatter(md.DateFormatter('%H:%M', tz=self.local_begin_night.tzinfo))
         
-        ax2.plot(self.utc_time_array, np.zeros(length_of_night))
+        utc_dates = md.date2num(self.utc_time_array)
+        ax2.plot(utc_dates, np.zeros(length_of_night))
         ax2.set_xlabel("UTC")
         ax2.get_xaxis().set_major_formatter(md.DateFormatter('%H:%M'))
 
-        ax3.plot(self.utc_time_array, np.zeros(length_of_night))
+        ax3.plot(utc_dates, np.zeros(length_of_night))
         num_ticks = 11
         nn = round(length_of_night/num_ticks)
         ax3_ind = [i*nn for i in range(num_ticks)]
@@ -183,30 +835,28 @@ class Observatory():
         ax3.set_xlabel("LST")
         ax3.xaxis.set_ticks_position("bottom")
         ax3.xaxis.set_label_position("bottom")
-        ax3.set_xticks(np.asarray(self.utc_time_array)[ax3_ind])
-        ax3.set_xticklabels(np.asarray(self.sidereal_string_array)[[ax3_ind]]) #,rotation=0,fontsize='small'
+        ax3.set_xticks(utc_dates[ax3_ind])
+        ax3.set_xticklabels(self.sidereal_strings(ax3_ind)) #,rotation=0,fontsize='small'
         # Offset the twin axis below the host
         ax3.spines["bottom"].set_position(("axes", -0.18))
 
-        total_tgts = 0
-        for tgt in good_targets:
-            lbl = "%s\nNat Pri: %s\nNet Pri: %0.5f\n%s min" % (tgt.name, tgt.priority, tgt.net_priority, tgt.total_minutes)
-            total_tgts += tgt.total_minutes
-            col = next(c)
-
-            ax1.plot(self.local_time_array,tgt.raw_airmass_array,c=col,linewidth=3.0,alpha=0.1)
-            ax1.plot(tgt.scheduled_time_array,tgt.scheduled_airmass_array,c=col,label=lbl,linewidth=3.0)
+        # All background tracks in one collection, all scheduled segments in another
+        track_dates = md.date2num(data["track_times"])
+        if n > 0:
+            ax1.add_collection(LineCollection([np.column_stack((track_dates, t["airmass"])) for t in data["tracks"]], \
+                                              colors=colors, linewidths=3.0, alpha=0.1))
+            ax1.add_collection(LineCollection([np.column_stack((md.date2num(t["scheduled_time"]), t["scheduled_airmass"])) \
+                                               for t in data["tracks"]], colors=colors, linewidths=3.0))
+        ax1.set_xlim(track_dates[0], track_dates[-1])
 
-        leg = ax1.legend(bbox_to_anchor=(1.01, 1.015), loc='upper left', ncol=2, prop={'size':8})
-        # set the linewidth of each legend object
-        for legobj in leg.legendHandles:
-            legobj.set_linewidth(3.0)
+        if self.plot_legend and n > 0:
+            handles = [Line2D([], [], color=col, linewidth=3.0) for col in colors]
+            ax1.legend(handles, [t["label"] for t in data["tracks"]], \
+                       bbox_to_anchor=(1.01, 1.015), loc='upper left', ncol=2, prop={'size':8})
 
-        percent1 = 100*float(total_tgts)/float(self.length_of_night)
         fig.suptitle("%s %s: %s\nOpen Shutter Time: %0.2f%%" % \
-             (self.name, telescope_name, self.obs_date.date(),percent1),y=1.10)
+             (self.name, data["telescope_name"], self.obs_date.date(), data["percent"]),y=1.10)
     
-        fig_to_save = "%s_%s_%s_Plot.png" % (self.name, telescope_name, self.obs_date_string)
-        fig.savefig(fig_to_save,bbox_inches='tight',dpi=300)
+        fig.savefig(data["file_name"],bbox_inches='tight',dpi=self.plot_dpi)
 
-        plt.show(block=False)
\ No newline at end of file
+        return data["file_name"]
@@ -0,0 +1,112 @@
+import math
+import random
+import time
+
+import numpy as np
+
+
+# Value of scheduling a target: its natural priority weight (1 = most important), so a schedule
+# never trades a more important target for a longer, less important one. Observing time only
+# breaks ties between otherwise equal schedules.
+def target_value(tgt):
+    return 1.0/max(float(tgt.priority), 1e-6) + 1e-6*float(tgt.total_minutes)
+
+# Simulated-annealing local search over a night's placements, started from the greedy schedule.
+# Moves release one scheduled target and either swap in an unscheduled one or shift it to another
+# feasible start, then greedily refill the freed time (from an empty schedule a move only refills).
+# The objective is the total priority weight of the scheduled targets (sum of target_value), and the
+# best schedule seen within time_budget seconds is kept.
+class LocalSearchOptimizer():
+    def __init__(self, observatory, find_slot, seed=None):
+        self.observatory = observatory
+        self.find_slot = find_slot
+        self.rng = random.Random(seed)
+
+    def num_steps(self, tgt):
+        return self.observatory.minutes_to_steps(tgt.total_minutes)
+
+    # Every start at which tgt fits in the free, observable time
+    def feasible_starts(self, tgt, time_slots):
+        k = self.num_steps(tgt)
+        starts = [np.empty(0, dtype=int)]
+
+        for range_start, range_end in self.observatory.candidate_ranges(tgt, k, time_slots):
+            starts.append(np.arange(range_start, range_end - k + 1))
+
+        return np.concatenate(starts)
+
+    def place(self, tgt, start, placements, time_slots):
+        time_slots.reserve(start, start + self.num_steps(tgt))
+        placements[tgt] = start
+
+    def unplace(self, tgt, placements, time_slots):
+        start = placements.pop(tgt)
+        time_slots.release(start, start + self.num_steps(tgt))
+
+    # Try to place each candidate in its best free slot
+    def refill(self, candidates, placements, time_slots):
+        for tgt in candidates:
+            if tgt in placements:
+                continue
+            best_indices = self.find_slot(tgt, self.num_steps(tgt), time_slots)
+            if best_indices is not None:
+                self.place(tgt, best_indices[0], placements, time_slots)
+
+    def run(self, scheduled, unscheduled, time_slots, time_budget, max_refill=10):
+        begin = time.perf_counter()
+        candidates = [t for t in scheduled + unscheduled if t.total_observable_min > 0]
+
+        placements = {t: t.starting_index for t in scheduled}
+        time_slots = time_slots.copy()
+        score = sum(target_value(t) for t in placements)
+        greedy_score = score
+
+        best_placements = dict(placements)
+        best_score = score
+        initial_temperature = 0.1*np.mean([target_value(t) for t in candidates]) if len(candidates) > 0 else 0.0
+
+        iterations = 0
+        accepted = 0
+        while len(candidates) > 0 and time.perf_counter() - begin < time_budget:
+            iterations += 1
+            elapsed_fraction = (time.perf_counter() - begin)/time_budget
+            temperature = max(initial_temperature*(1.0 - elapsed_fraction), 1e-12)
+
+            trial_placements = dict(placements)
+            trial_slots = time_slots.copy()
+            waiting = [t for t in candidates if t not in trial_placements]
+
+            refill = []
+            if len(trial_placements) > 0:
+                released = self.rng.choice(list(trial_placements))
+                self.unplace(released, trial_placements, trial_slots)
+
+                if len(waiting) > 0 and self.rng.random() < 0.5:
+                    # Swap: put an unscheduled target into the freed time first
+                    refill = [self.rng.choice(waiting), released]
+                else:
+                    # Shift: move the released target to a random other feasible start
+                    starts = self.feasible_starts(released, trial_slots)
+                    if len(starts) > 0:
+                        self.place(released, int(self.rng.choice(starts)), trial_placements, trial_slots)
+                    refill = [released]
+
+            refill += self.rng.sample(waiting, min(max_refill, len(waiting)))
+            self.refill(refill, trial_placements, trial_slots)
+
+            trial_score = sum(target_value(t) for t in trial_placements)
+            delta = trial_score - score
+            if delta >= 0 or self.rng.random() < math.exp(delta/temperature):
+                placements, time_slots, score = trial_placements, trial_slots, trial_score
+                accepted += 1
+                if score > best_score:
+                    best_placements, best_score = dict(placements), score
+
+        return best_placements, {
+            "greedy_score": greedy_score,
+            "optimized_score": best_score,
+            "improvement_percent": 100.0*(best_score - greedy_score)/greedy_score if greedy_score > 0 else 0.0,
+            "iterations": iterations,
+            "accepted_moves": accepted,
+            "seconds": time.perf_counter() - begin
+        }
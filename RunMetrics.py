@@ -0,0 +1,40 @@
+import json
+import time
+from contextlib import contextmanager
+
+# Instrumentation for one scheduling run (one telescope, one night): wall-clock seconds per
+# pipeline stage, event counters and summary values, written out as a JSON run report
+class RunMetrics():
+    def __init__(self, **info):
+        self.info = info
+        self.stages = {}
+        self.counters = {}
+        self.values = {}
+
+    # Times the enclosed block; a stage entered more than once accumulates
+    @contextmanager
+    def stage(self, name):
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - begin
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def set(self, name, value):
+        self.values[name] = value
+
+    def report(self):
+        return dict(self.info, stages=self.stages, counters=self.counters, values=self.values)
+
+    def write(self, file_name):
+        with open(file_name, "w") as jsonoutput:
+            json.dump(self.report(), jsonoutput, indent=2, default=json_value)
+
+# numpy scalars/arrays and datetimes in reports
+def json_value(value):
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return str(value)
@@ -0,0 +1,202 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+
+try:
+    import fcntl # POSIX; without it, appends from concurrent processes are not serialized
+except ImportError:
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+# One row per scheduled target per night
+archive_dtype = np.dtype([
+    ("date", "datetime64[D]"), # observation date (UTC noon that starts the night)
+    ("observatory", "U16"),
+    ("telescope", "U16"),
+    ("target", "U32"),
+    ("record_index", np.int64), # position in the input catalog
+    ("start_index", np.int32), # first time step of the night
+    ("start_utc", "datetime64[s]"),
+    ("num_steps", np.int32),
+    ("minutes", np.int32), # budgeted block length with a nominal slew; num_steps is the placed length
+    ("mean_airmass", np.float32),
+    ("max_airmass", np.float32),
+    ("filters", "U32"), # comma-delimited, in observing order
+    ("exposure_seconds", np.float32)
+])
+
+# Appendable columnar store of nightly schedules: a directory holding one raw binary file per
+# column of archive_dtype plus a small JSON schema. Nights are appended in bulk (one write per
+# column; re-archiving a night replaces its rows), and columns are read back as read-only memory
+# maps, so months of schedules can be filtered without re-parsing the operator CSVs.
+class ScheduleArchive():
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+        schema_file = os.path.join(path, "schema.json")
+        schema = [[name, archive_dtype[name].str] for name in archive_dtype.names]
+        if os.path.exists(schema_file):
+            with open(schema_file, "r") as jsoninput:
+                if json.load(jsoninput) != schema:
+                    raise ValueError("%s was written with a different schedule archive layout!" % path)
+        else:
+            with open(schema_file, "w") as jsonoutput:
+                json.dump(schema, jsonoutput, indent=2)
+
+    def column_file(self, name):
+        return os.path.join(self.path, "%s.bin" % name)
+
+    # Rows in every column; a column left longer by an interrupted append is ignored past this
+    def __len__(self):
+        return min(os.path.getsize(self.column_file(name))//archive_dtype[name].itemsize \
+                   if os.path.exists(self.column_file(name)) else 0 for name in archive_dtype.names)
+
+    # Exclusive lock around appends, so season runs in several worker processes can share an archive
+    @contextmanager
+    def locked(self):
+        with open(os.path.join(self.path, "lock"), "w") as lockfile:
+            if fcntl is not None:
+                fcntl.flock(lockfile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    # Append rows (an archive_dtype array or anything convertible to one). With night, a (date,
+    # observatory, telescope) tuple, the rows already archived for that night are dropped first,
+    # under the same lock, so re-running a night replaces it instead of counting it twice.
+    def append(self, rows, night=None):
+        rows = np.asarray(rows, dtype=archive_dtype)
+
+        with self.locked():
+            num_rows = len(self)
+            if night is not None:
+                num_rows = self.drop_night(num_rows, *night)
+
+            if len(rows) > 0:
+                for name in archive_dtype.names:
+                    with open(self.column_file(name), "ab") as binoutput:
+                        binoutput.truncate(num_rows*archive_dtype[name].itemsize)
+                        np.ascontiguousarray(rows[name]).tofile(binoutput)
+
+        log.debug("Archived %s rows to %s", len(rows), self.path)
+
+    # Rewrite the first num_rows rows of every column without one night's rows, and return how many
+    # are left. Callers hold the lock.
+    def drop_night(self, num_rows, date, observatory, telescope):
+        if num_rows == 0:
+            return num_rows
+
+        columns = {name: np.fromfile(self.column_file(name), dtype=archive_dtype[name], count=num_rows) \
+                   for name in archive_dtype.names}
+        keep = (columns["date"] != np.datetime64(date, "D")) | (columns["observatory"] != observatory) | \
+               (columns["telescope"] != telescope)
+        if keep.all():
+            return num_rows
+
+        for name in archive_dtype.names:
+            with open(self.column_file(name) + ".tmp", "wb") as binoutput:
+                columns[name][keep].tofile(binoutput)
+        for name in archive_dtype.names:
+            os.replace(self.column_file(name) + ".tmp", self.column_file(name))
+
+        log.info("Replacing %s archived rows for %s %s %s", num_rows - int(keep.sum()), observatory, telescope, date)
+        return int(keep.sum())
+
+    # One night's placements for one telescope, replacing any archived earlier for that night;
+    # sequences are the targets' filter sequences
+    def append_schedule(self, observatory_name, telescope_name, obs_date, targets, sequences):
+        date = np.datetime64(obs_date.strftime("%Y-%m-%d"))
+        rows = np.zeros(len(targets), dtype=archive_dtype)
+        rows["date"] = date
+        rows["observatory"] = text_value("observatory", observatory_name)
+        rows["telescope"] = text_value("telescope", telescope_name)
+
+        for row, t, sequence in zip(rows, targets, sequences):
+            airmass = np.asarray(t.scheduled_airmass_array, dtype=float)
+            row["target"] = text_value("target", t.name)
+            row["record_index"] = t.record_index
+            row["start_index"] = t.starting_index
+            row["start_utc"] = utc_datetime64(t.scheduled_time_array[0])
+            row["num_steps"] = len(t.scheduled_time_array)
+            row["minutes"] = t.total_minutes
+            row["mean_airmass"] = np.mean(airmass)
+            row["max_airmass"] = np.max(airmass)
+            row["filters"] = text_value("filters", ",".join(sequence))
+            row["exposure_seconds"] = sum(t.exposures.values())
+
+        self.append(rows, night=(date, observatory_name, telescope_name))
+
+    # Read-only memory map of one column
+    def column(self, name):
+        num_rows = len(self)
+        if num_rows == 0:
+            return np.empty(0, dtype=archive_dtype[name])
+        return np.memmap(self.column_file(name), dtype=archive_dtype[name], mode="r", shape=(num_rows,))
+
+    # Rows matching every given filter (dates are inclusive, YYYYMMDD strings or datetimes), as an
+    # archive_dtype array. Only the filtered columns are read in full.
+    def query(self, start_date=None, end_date=None, observatory=None, telescope=None, target=None):
+        selected = np.ones(len(self), dtype=bool)
+        if start_date is not None:
+            selected &= self.column("date") >= archive_date(start_date)
+        if end_date is not None:
+            selected &= self.column("date") <= archive_date(end_date)
+        for name, value in (("observatory", observatory), ("telescope", telescope), ("target", target)):
+            if value is not None:
+                selected &= self.column(name) == value
+
+        indices = np.flatnonzero(selected)
+        rows = np.empty(len(indices), dtype=archive_dtype)
+        for name in archive_dtype.names:
+            rows[name] = self.column(name)[indices]
+
+        return rows
+
+# value for a text column of archive_dtype, which numpy would otherwise truncate without a word
+def text_value(name, value):
+    max_length = archive_dtype[name].itemsize//np.dtype("U1").itemsize
+    if len(value) > max_length:
+        raise ValueError("Archive %s '%s' is longer than %s characters!" % (name, value, max_length))
+    return value
+
+def archive_date(value):
+    if isinstance(value, str):
+        value = datetime.strptime(value, "%Y%m%d")
+    return np.datetime64(value.strftime("%Y-%m-%d"))
+
+# Time-zone aware (or naive UTC) datetime as a naive UTC datetime64
+def utc_datetime64(value):
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return np.datetime64(value, "s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Export rows of a schedule archive as CSV.")
+    parser.add_argument("archive", help="Schedule archive directory (see CreateSchedule.py --archive).")
+    parser.add_argument("-sd", "--startdate", default=None, help="YYYYMMDD formatted first night.")
+    parser.add_argument("-ed", "--enddate", default=None, help="YYYYMMDD formatted last night.")
+    parser.add_argument("-ot", "--obstele", default=None, help="<Observatory>:<Telescope> to export.")
+    parser.add_argument("-t", "--target", default=None, help="Target name to export.")
+    args = parser.parse_args()
+
+    observatory, telescope = args.obstele.split(":") if args.obstele is not None else (None, None)
+    rows = ScheduleArchive(args.archive).query(args.startdate, args.enddate, observatory, telescope, args.target)
+
+    writer = csv.writer(sys.stdout, lineterminator="\n")
+    writer.writerow(archive_dtype.names)
+    writer.writerows(rows.tolist())
+
+    return 0
+
+if __name__ == "__main__": sys.exit(main())
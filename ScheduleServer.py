@@ -0,0 +1,365 @@
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+
+from CreateSchedule import observatory_sites, build_observatory, configure_logging
+from Dispatcher import Dispatcher
+from RunMetrics import RunMetrics
+import Constants
+from Target import TargetCatalog, observable_windows
+from Utilities import read_target_catalog_csv
+
+log = logging.getLogger(__name__)
+
+http_reasons = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error"
+}
+
+# A catalog as seen from one site and night: the records that pass Observatory.select_observable,
+# their positions in the full catalog, the rejected names and the observable windows of the kept records
+class SiteCatalog():
+    def __init__(self, obs, catalog):
+        self.obs = obs
+        self.records, self.record_index, self.rejected = obs.select_observable(catalog)
+        self.windows = self.observable_windows(self.records)
+
+    def observable_windows(self, records):
+        return observable_windows(records["ra"], records["dec"], self.obs.ephemeris.lat, self.obs.sidereal_radian_array, \
+                                  Constants.airmass_threshold)
+
+    # Add records appended to the full catalog at position offset; only their windows are computed
+    def extend(self, records, offset):
+        records, record_index, rejected = self.obs.select_observable(records)
+        new_starts, new_ends = self.observable_windows(records)
+
+        self.records = np.concatenate((self.records, records))
+        self.record_index = np.concatenate((self.record_index, record_index + offset))
+        self.rejected = self.rejected + rejected
+        self.windows = (np.vstack((self.windows[0], new_starts)), np.vstack((self.windows[1], new_ends)))
+
+# Long-running scheduler. Keeps uploaded target catalogs, Observatory objects (twilight, time and
+# sidereal axes) and each catalog's observable windows at each site warm between requests, so a new
+# night plan only costs the exposure, priority and placement passes. Schedules are written to the
+# working directory as usual and returned in the same CSV format.
+class ScheduleService():
+    def __init__(self, options):
+        self.options = options
+        self.catalogs = {} # name -> catalog records (Utilities.catalog_dtype)
+        self.observatories = {} # (obs_key, date) -> Observatory
+        self.site_catalogs = {} # (catalog name, obs_key, date) -> SiteCatalog
+        self.dispatchers = {} # (catalog name, obs_key, tele_key, date) -> Dispatcher
+        self.started = time.time()
+
+        # All catalog and Observatory state is shared, so jobs run one at a time, off the event loop
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def observatory(self, obs_key, obs_date):
+        if obs_key not in observatory_sites:
+            raise ValueError("Unknown observatory '%s'!" % obs_key)
+
+        key = (obs_key, obs_date)
+        if key not in self.observatories:
+            self.observatories[key] = build_observatory(obs_key, obs_date, self.options)
+        return self.observatories[key]
+
+    def site_catalog(self, name, obs_key, obs_date):
+        key = (name, obs_key, obs_date)
+        if key not in self.site_catalogs:
+            self.site_catalogs[key] = SiteCatalog(self.observatory(obs_key, obs_date), self.catalogs[name])
+        return self.site_catalogs[key]
+
+    # Replace (or, with append, extend) a named catalog. Appending only evaluates the observable
+    # windows of the new rows. Dispatch addresses targets by name, so names must be unique.
+    def upload_targets(self, name, text, append=False):
+        records = read_target_catalog_csv(io.StringIO(text), "upload '%s'" % name)
+        if len(records) == 0:
+            raise ValueError("No valid targets in upload!")
+
+        names = records["name"]
+        if append and name in self.catalogs:
+            names = np.concatenate((self.catalogs[name]["name"], names))
+        unique_names, counts = np.unique(names.astype(str), return_counts=True)
+        duplicates = unique_names[counts > 1]
+        if len(duplicates) > 0:
+            raise ValueError("Duplicate target names in catalog '%s': %s" % (name, ", ".join(duplicates)))
+
+        # Dispatchers are rebuilt on next use, keeping the night's progress
+        for key in [k for k in self.dispatchers if k[0] == name]:
+            if isinstance(self.dispatchers[key], Dispatcher):
+                self.dispatchers[key] = self.dispatchers[key].progress()
+
+        if append and name in self.catalogs:
+            for key in [k for k in self.site_catalogs if k[0] == name]:
+                self.site_catalogs[key].extend(records, len(self.catalogs[name]))
+            self.catalogs[name] = np.concatenate((self.catalogs[name], records))
+        else:
+            self.catalogs[name] = records
+            for key in [k for k in self.site_catalogs if k[0] == name]:
+                del self.site_catalogs[key]
+
+        log.info("Catalog '%s': %s targets (%s uploaded)", name, len(self.catalogs[name]), len(records))
+        return {"catalog": name, "targets": len(self.catalogs[name]), "uploaded": len(records)}
+
+    # Schedule one telescope for one night; returns the schedule CSV text
+    def schedule(self, name, obs_key, tele_key, obs_date, slot_search="prefix", optimize_seconds=None, tighten=False):
+        if name not in self.catalogs:
+            raise ValueError("Unknown catalog '%s'; upload it to /targets first!" % name)
+
+        obs = self.observatory(obs_key, obs_date)
+        if tele_key not in obs.telescopes:
+            raise ValueError("Unknown telescope '%s' at %s!" % (tele_key, obs_key))
+        if slot_search not in obs.slot_finders:
+            raise ValueError("Unknown slot search '%s'!" % slot_search)
+
+        metrics = RunMetrics(catalog=name)
+        with metrics.stage("targets"):
+            site = self.site_catalog(name, obs_key, obs_date)
+            targets = TargetCatalog(site.records, obs.ephemeris.lat, obs.sidereal_radian_array, obs.obs_date, \
+                                    windows=site.windows, record_index=site.record_index, time_step=obs.time_step).targets()
+        metrics.count("rejected", len(site.rejected))
+        metrics.set("rejected_targets", site.rejected)
+
+        telescope = obs.telescopes[tele_key]
+        telescope.set_targets(targets)
+        obs.schedule_targets(tele_key, slot_search=slot_search, optimize_seconds=optimize_seconds, plot=False, metrics=metrics, \
+                             tighten=tighten)
+
+        with open(telescope.schedule_file_name(obs.name, obs.obs_date), "r") as csvinput:
+            return csvinput.read()
+
+    # Real-time dispatch state for one telescope and night, built from the catalog on first use
+    def dispatcher(self, name, obs_key, tele_key, obs_date):
+        if name not in self.catalogs:
+            raise ValueError("Unknown catalog '%s'; upload it to /targets first!" % name)
+
+        obs = self.observatory(obs_key, obs_date)
+        if tele_key not in obs.telescopes:
+            raise ValueError("Unknown telescope '%s' at %s!" % (tele_key, obs_key))
+
+        key = (name, obs_key, tele_key, obs_date)
+        if not isinstance(self.dispatchers.get(key), Dispatcher):
+            site = self.site_catalog(name, obs_key, obs_date)
+            targets = TargetCatalog(site.records, obs.ephemeris.lat, obs.sidereal_radian_array, obs.obs_date, \
+                                    windows=site.windows, record_index=site.record_index, time_step=obs.time_step).targets()
+            telescope = obs.telescopes[tele_key]
+            telescope.set_targets(targets)
+            telescope.compute_exposures()
+            telescope.compute_net_priorities()
+            progress = self.dispatchers.get(key, {})
+            self.dispatchers[key] = Dispatcher(obs, targets, done=progress.get("done", ()), skipped=progress.get("skipped"))
+            self.dispatchers[key].advance(progress.get("step", 0))
+        return self.dispatchers[key]
+
+    # What to observe at utc_time (an ISO string; default now), as a JSON-ready dict. "status" is
+    # the dispatcher's night_status at that time.
+    def dispatch_next(self, name, obs_key, tele_key, obs_date, utc_time=None):
+        dispatcher = self.dispatcher(name, obs_key, tele_key, obs_date)
+        implicit_now = utc_time is None
+        utc_time = datetime.now(timezone.utc) if implicit_now else datetime.fromisoformat(utc_time)
+        if utc_time.tzinfo is not None:
+            utc_time = utc_time.astimezone(timezone.utc).replace(tzinfo=None)
+
+        # Nothing can start before the night; and "now" past the end of another date's night must not
+        # move the shared dispatcher beyond steps later explicit-time queries still ask about
+        status = dispatcher.night_status(utc_time)
+        if status == "not started":
+            return {"target": None, "status": status, "night_start": dispatcher.observatory.utc_begin_night.isoformat()}
+        if implicit_now and status == "over":
+            return {"target": None, "status": status}
+
+        tgt = dispatcher.next(utc_time)
+        if tgt is None:
+            return {"target": None, "status": status}
+
+        telescope = self.observatory(obs_key, obs_date).telescopes[tele_key]
+        return {
+            "target": tgt.name,
+            "status": status,
+            "ra": tgt.coord.ra.to_string(unit="hour", sep=":", precision=1),
+            "dec": tgt.coord.dec.to_string(sep=":", precision=1),
+            "net_priority": tgt.net_priority,
+            "minutes": tgt.total_minutes,
+            "exposures": [[f, tgt.exposures[f]] for f in telescope.filter_sequence(tgt.exposures)],
+            "latest_start": dispatcher.latest_start(tgt).isoformat()
+        }
+
+    # Mark a target observed (action "done") or pass over it (action "skip", for minutes or the night)
+    def dispatch_update(self, name, obs_key, tele_key, obs_date, action, target, minutes=None):
+        dispatcher = self.dispatcher(name, obs_key, tele_key, obs_date)
+        if target not in dispatcher.targets:
+            raise ValueError("Unknown target '%s'!" % target)
+
+        if action == "done":
+            dispatcher.mark_done(dispatcher.targets[target])
+        else:
+            dispatcher.skip(dispatcher.targets[target], minutes)
+        return {"target": target, action: True}
+
+    def status(self):
+        return {
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "catalogs": {name: len(catalog) for name, catalog in self.catalogs.items()},
+            "observatories": ["%s:%s" % key for key in self.observatories],
+            "site_catalogs": ["%s@%s:%s" % key for key in self.site_catalogs],
+            "dispatchers": ["%s@%s:%s:%s" % key for key in self.dispatchers]
+        }
+
+    async def run_job(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    # GET  /status
+    # POST /targets?catalog=<name>[&append=1]                       body: targets CSV
+    # GET  /schedule?obstele=<Obs>:<Tele>&date=YYYYMMDD[&catalog=<name>][&slotsearch=...][&optimize=<s>][&tighten=1]
+    # GET  /dispatch/next?obstele=<Obs>:<Tele>&date=YYYYMMDD[&catalog=<name>][&time=<ISO UTC>]
+    # POST /dispatch/done?obstele=<Obs>:<Tele>&date=YYYYMMDD&target=<name>[&catalog=<name>]
+    # POST /dispatch/skip?obstele=<Obs>:<Tele>&date=YYYYMMDD&target=<name>[&minutes=<m>][&catalog=<name>]
+    async def route(self, method, target, body):
+        url = urlsplit(target)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        catalog = query.get("catalog", "default")
+
+        if url.path == "/status":
+            return 200, "application/json", json.dumps(self.status())
+
+        if url.path == "/targets":
+            if method != "POST":
+                return 405, "text/plain", "POST a targets CSV to /targets\n"
+            result = await self.run_job(self.upload_targets, catalog, body.decode("utf-8"), query.get("append") == "1")
+            return 200, "application/json", json.dumps(result)
+
+        if url.path == "/schedule":
+            if "obstele" not in query or "date" not in query:
+                raise ValueError("/schedule needs obstele=<Observatory>:<Telescope> and date=YYYYMMDD")
+            obs_key, _, tele_key = query["obstele"].partition(":")
+            optimize_seconds = float(query["optimize"]) if "optimize" in query else None
+            schedule_csv = await self.run_job(self.schedule, catalog, obs_key, tele_key, query["date"], \
+                                              query.get("slotsearch", "prefix"), optimize_seconds, query.get("tighten") == "1")
+            return 200, "text/csv", schedule_csv
+
+        if url.path.startswith("/dispatch/"):
+            if "obstele" not in query or "date" not in query:
+                raise ValueError("%s needs obstele=<Observatory>:<Telescope> and date=YYYYMMDD" % url.path)
+            obs_key, _, tele_key = query["obstele"].partition(":")
+            action = url.path[len("/dispatch/"):]
+
+            if action == "next":
+                result = await self.run_job(self.dispatch_next, catalog, obs_key, tele_key, query["date"], query.get("time"))
+                return 200, "application/json", json.dumps(result)
+            if action in ("done", "skip"):
+                if method != "POST":
+                    return 405, "text/plain", "POST to %s\n" % url.path
+                if "target" not in query:
+                    raise ValueError("%s needs target=<name>" % url.path)
+                minutes = float(query["minutes"]) if "minutes" in query else None
+                result = await self.run_job(self.dispatch_update, catalog, obs_key, tele_key, query["date"], action, \
+                                            query["target"], minutes)
+                return 200, "application/json", json.dumps(result)
+
+        return 404, "text/plain", "Unknown path %s\n" % url.path
+
+    # One HTTP/1.1 request per connection
+    async def handle(self, reader, writer):
+        begin = time.perf_counter()
+        method, target = "-", "-"
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            if len(request_line) < 2:
+                raise ValueError("Malformed request line")
+            method, target = request_line[0], request_line[1]
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                header, _, value = line.decode("latin-1").partition(":")
+                headers[header.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+            status, content_type, content = await self.route(method, target, body)
+        except (ValueError, KeyError) as e:
+            status, content_type, content = 400, "text/plain", "%s\n" % e
+        except Exception as e:
+            log.exception("%s %s failed", method, target)
+            status, content_type, content = 500, "text/plain", "%s\n" % e
+
+        payload = content.encode("utf-8")
+        writer.write(("HTTP/1.1 %s %s\r\nContent-Type: %s\r\nContent-Length: %s\r\nConnection: close\r\n\r\n" % \
+                      (status, http_reasons[status], content_type, len(payload))).encode("latin-1") + payload)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+        log.info("%s %s -> %s (%0.1f ms)", method, target, status, 1000*(time.perf_counter() - begin))
+
+async def serve(service, host, port, socket_path):
+    if socket_path is not None:
+        server = await asyncio.start_unix_server(service.handle, path=socket_path)
+        log.info("Serving on unix:%s", socket_path)
+    else:
+        server = await asyncio.start_server(service.handle, host, port)
+        log.info("Serving on http://%s:%s", host, port)
+
+    async with server:
+        await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Long-running scheduler service with warm observatory and observability caches.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on. Default: 127.0.0.1.")
+    parser.add_argument("-p", "--port", type=int, default=8750, help="TCP port. Default: 8750.")
+    parser.add_argument("--socket", default=None, help="Listen on this Unix socket instead of TCP.")
+    parser.add_argument("-o", "--outdir", default=".", help="Directory the schedules and run reports are written to. Default: current directory.")
+    parser.add_argument("-f", "--file", default=None, help="CSV file with targets to preload as catalog 'default'.")
+    parser.add_argument("-d", "--date", default=None, help="YYYYMMDD formatted observation date to warm up at start.")
+    parser.add_argument("-ot", "--obstele", default=None, help="Comma-delimited list of <Observatory>:<Telescope> to warm up at start.")
+    parser.add_argument("-cd", "--cachedir", default=".ephemeris_cache", help="Directory for cached twilight/sidereal time. Pass an empty string to disable.")
+    parser.add_argument("-ts", "--timestep", type=int, default=60, help="Time resolution of the night, in seconds. Default: 60.")
+    parser.add_argument("-l", "--loglevel", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="Console log level. Default: INFO.")
+    args = parser.parse_args()
+
+    configure_logging(args.loglevel)
+    os.environ["MPLBACKEND"] = "Agg"
+    os.chdir(args.outdir)
+
+    service = ScheduleService({
+        "cache_dir": args.cachedir or None,
+        "time_step": args.timestep,
+        "plot_dpi": 300,
+        "plot_legend": True
+    })
+
+    if args.file is not None:
+        with open(args.file, "r") as csvinput:
+            service.upload_targets("default", csvinput.read())
+
+    if args.date is not None and args.obstele is not None:
+        from astropy.coordinates import SkyCoord # first use is otherwise paid by the first schedule request
+        for obs_tele in args.obstele.split(","):
+            obs_key = obs_tele.split(":")[0]
+            service.observatory(obs_key, args.date)
+            if "default" in service.catalogs:
+                service.site_catalog("default", obs_key, args.date)
+
+    try:
+        asyncio.run(serve(service, args.host, args.port, args.socket))
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+if __name__ == "__main__": sys.exit(main())
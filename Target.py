@@ -4,6 +4,8 @@ from enum import Enum
 
 import numpy as np
 
+import Constants
+
 class TargetType(Enum):
     Supernova = 1
     Template = 2
@@ -11,55 +13,352 @@ class TargetType(Enum):
     GW_Static = 4
     GW_Dynamic = 5
 
+# Target type codes used in target CSV files
+target_type_codes = {
+    "SN": TargetType.Supernova,
+    "TMP": TargetType.Template,
+    "STD": TargetType.Standard,
+    "GW_Static": TargetType.GW_Static,
+    "GW_Dynamic": TargetType.GW_Dynamic
+}
+
+# Opt-in precomputed airmass cache for TargetCatalog: storage name -> (dtype, scale). Stored values
+# are airmass*scale, rounded to nearest for integer types but never across the airmass cutoff;
+# the out-of-range flag is stored as the dtype's largest value.
+airmass_storage_types = {
+    "float32": (np.float32, 1.0),
+    "uint16": (np.uint16, 1.0e4)
+}
+
 #DRAGON’s Copy
 
-class Target:
-    def __init__(self, name, coord, priority, target_type, observatory_lat, sidereal_radian_array, \
-                 disc_date=None, apparent_mag=None, obs_date=None, Static_Exp_Time=None, Est_Abs_Mag=None, Host_Dist_Mpc=None):
-        # Provided by Constructor
-        self.name = name
-        self.coord = coord
-        self.priority = priority
-        self.type = target_type
-        self.disc_date = disc_date
+# Struct-of-arrays store for every target in a catalog at one observatory: each column (static
+# catalog data, per-site observable windows, and the results filled in by Telescope/Observatory)
+# is its own contiguous array, indexed by catalog position. Code that wants objects uses
+# catalog.targets(), which returns lightweight Target views onto these arrays.
+#
+# Observability is kept as up to two [start, end) time-step windows per target; airmass values
+# are only evaluated on demand, for the steps that are asked for (see airmass), and nothing is
+# stored per time step. With airmass_storage (a key of airmass_storage_types), the whole airmass
+# matrix is instead computed once and cached in that encoding. This is a speed cache, not a memory
+# saving: it costs 2 or 4 bytes per target per time step, where the default keeps none, and makes
+# each slot search about 1.2x (uint16) to 1.8x (float32) faster by decoding instead of evaluating
+# the airmass over the free parts of the target's windows.
+class TargetCatalog():
+    # windows: previously computed observable_windows for these records at this site, if any.
+    # record_index: position of each record in the full input catalog, when records is a subset.
+    # time_step: seconds per entry of sidereal_radian_array
+    def __init__(self, records, observatory_lat, sidereal_radian_array, obs_date=None, windows=None, record_index=None, \
+                 airmass_storage=None, time_step=60):
+        # Provided by Constructor (see Utilities.catalog_dtype)
+        self.names = np.ascontiguousarray(records["name"])
+        self.ra = np.ascontiguousarray(records["ra"]) # radians
+        self.dec = np.ascontiguousarray(records["dec"]) # radians
+        self.priority = np.array(records["priority"], dtype=float)
+        self.type = np.ascontiguousarray(records["type"]) # TargetType values
+        self.disc_date = np.ascontiguousarray(records["disc_date"])
+        self.apparent_mag = np.ascontiguousarray(records["disc_mag"])
+        self.static_exp_time = np.ascontiguousarray(records["static_exp_time"]) #set by human, or default to 120 sec
+        self.est_abs_mag = np.ascontiguousarray(records["est_abs_mag"])
+        self.host_dist_mpc = np.ascontiguousarray(records["host_dist_mpc"])
         self.obs_date = obs_date
-        self.static_exp_time = Static_Exp_Time #set by human, or default to 120 sec
-        self.apparent_mag = apparent_mag #Computed by assumed absolute Mag and distance to host galaxy
-        self.est_abs_mag = Est_Abs_Mag
-        self.host_dist_mpc = Host_Dist_Mpc
-        
-        # Computed by Constructor
-        self.raw_airmass_array = self.compute_airmass(observatory_lat, sidereal_radian_array)
-        
+        self.record_index = np.arange(len(records)) if record_index is None else np.asarray(record_index)
+
+        # Computed by Constructor: per-site time axis and observable windows
+        self.lat = float(observatory_lat)
+        self.sidereal_radian_array = np.asarray(sidereal_radian_array, dtype=float)
+        self.time_step = time_step
+        if windows is None:
+            windows = observable_windows(self.ra, self.dec, self.lat, self.sidereal_radian_array, Constants.airmass_threshold)
+        self.window_starts, self.window_ends = windows
+
+        self.airmass_storage = airmass_storage
+        self.airmass_codes = None
+        if airmass_storage is not None:
+            self.airmass_codes = compute_compact_airmass_matrix(self.ra, self.dec, self.lat, self.sidereal_radian_array, airmass_storage)
+
         # Computed by Telescope
-        self.net_priority = self.priority
-        self.starting_index = 0 # Used to order net priority
-        self.exposures = None # Dictionary: filter:minutes
-        self.total_observable_min = 0 # How many minutes in the night is the target observable?
-        self.total_minutes = 0 # Total length of observation
-        self.fraction_time_obs = 9999 # TotalMinutes / TotalObservableMin
-        self.total_good_air_mass = 9999 # Proxy for elevation
-        self.scheduled_time_array = None # Airmass plot abscissa
-        self.scheduled_airmass_array = None # Airmass plot ordinate
-        
-    
-    def compute_airmass(self, observatory_lat, sidereal_radian_array):
-        n = len(sidereal_radian_array)
-
-        RA = np.empty(n)
-        RA.fill(self.coord.ra.radian)
-
-        DEC = np.empty(n)
-        DEC.fill(self.coord.dec.radian)
-
-        HA = sidereal_radian_array - RA
-        LAT = np.empty(n)
-        LAT.fill(observatory_lat)
-        
-        term1 = np.sin(DEC)*np.sin(LAT)
-        term2 = np.cos(DEC)*np.cos(LAT)*np.cos(HA)
-        am = 1.0/(np.sin(np.arcsin(term1+term2)))
-        
-        am[(am > 3.0) | (am < 1.0)] = 9999
-
-        return am
\ No newline at end of file
+        n = len(self.names)
+        self.net_priority = self.priority.copy()
+        self.starting_index = np.zeros(n, dtype=np.int64) # Used to order net priority
+        self.exposures = np.full(n, None, dtype=object) # Dictionary: filter:minutes
+        self.total_observable_min = np.zeros(n) # How many minutes in the night is the target observable?
+        self.total_minutes = np.zeros(n, dtype=np.int64) # Total length of observation
+        self.fraction_time_obs = np.full(n, 9999.0) # TotalMinutes / TotalObservableMin
+        self.total_good_air_mass = np.full(n, 9999.0) # Proxy for elevation
+        self.scheduled_time_array = np.full(n, None, dtype=object) # Airmass plot abscissa
+        self.scheduled_airmass_array = np.full(n, None, dtype=object) # Airmass plot ordinate
+
+        self.views = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index):
+        if self.views is None:
+            self.views = [Target(self, i) for i in range(len(self))]
+        return self.views[index]
+
+    # A new list of the (shared) Target views, in catalog order; callers may sort it freely
+    def targets(self):
+        return list(self[:])
+
+    # Airmass of target i at time steps "steps" (an index array or slice), flagged as in
+    # compute_airmass_matrix
+    def airmass(self, i, steps=slice(None)):
+        if self.airmass_codes is not None:
+            return decode_airmass(self.airmass_codes[i, steps], self.airmass_storage)
+        return airmass_values(self.ra[i], self.dec[i], self.lat, self.sidereal_radian_array[steps])
+
+
+# Values of a TargetCatalog column for a list of Target views, as one array. Views from a single
+# catalog are gathered with one fancy-index; mixed catalogs fall back to one lookup per target.
+def catalog_values(targets, column):
+    if len(targets) > 0:
+        catalog = targets[0].catalog
+        if all(t.catalog is catalog for t in targets):
+            return getattr(catalog, column)[[t.index for t in targets]]
+
+    return np.asarray([getattr(t.catalog, column)[t.index] for t in targets])
+
+# Property reading/writing element "index" of a TargetCatalog column
+def catalog_column(column, read_only=False):
+    def get(self):
+        value = getattr(self.catalog, column)[self.index]
+        return value.item() if isinstance(value, np.generic) else value
+
+    def set(self, value):
+        getattr(self.catalog, column)[self.index] = value
+
+    return property(get, None if read_only else set)
+
+class Target:
+    __slots__ = ("catalog", "index")
+
+    def __init__(self, catalog, index):
+        self.catalog = catalog
+        self.index = index
+
+    def __eq__(self, other):
+        return isinstance(other, Target) and self.catalog is other.catalog and self.index == other.index
+
+    def __hash__(self):
+        return hash((id(self.catalog), self.index))
+
+    name = catalog_column("names", read_only=True)
+    apparent_mag = catalog_column("apparent_mag", read_only=True) #Computed by assumed absolute Mag and distance to host galaxy
+    static_exp_time = catalog_column("static_exp_time", read_only=True)
+    est_abs_mag = catalog_column("est_abs_mag", read_only=True)
+    host_dist_mpc = catalog_column("host_dist_mpc", read_only=True)
+    priority = catalog_column("priority")
+
+    net_priority = catalog_column("net_priority")
+    starting_index = catalog_column("starting_index")
+    exposures = catalog_column("exposures")
+    total_observable_min = catalog_column("total_observable_min")
+    total_minutes = catalog_column("total_minutes")
+    fraction_time_obs = catalog_column("fraction_time_obs")
+    total_good_air_mass = catalog_column("total_good_air_mass")
+    scheduled_time_array = catalog_column("scheduled_time_array")
+    scheduled_airmass_array = catalog_column("scheduled_airmass_array")
+
+    @property
+    def type(self):
+        return TargetType(int(self.catalog.type[self.index]))
+
+    @property
+    def disc_date(self):
+        disc_date = self.catalog.disc_date[self.index]
+        return None if np.isnat(disc_date) else disc_date.astype(object)
+
+    @property
+    def obs_date(self):
+        return self.catalog.obs_date
+
+    # Position in the input catalog (the same target has the same record_index at every site)
+    @property
+    def record_index(self):
+        return int(self.catalog.record_index[self.index])
+
+    # Non-empty [start, end) time-step windows where the target is within the airmass threshold
+    @property
+    def observable_windows(self):
+        return [(int(start), int(end)) for start, end in zip(self.catalog.window_starts[self.index], self.catalog.window_ends[self.index]) \
+                if end > start]
+
+    # Minutes the target is observable tonight, on the time-step grid
+    @property
+    def observable_minutes(self):
+        return sum(end - start for start, end in self.observable_windows)*self.catalog.time_step/60.0
+
+    # Sum of the observable time-step indices (what total_observable_min was once computed as),
+    # summed per window in closed form
+    @property
+    def observable_step_sum(self):
+        return sum((start + end - 1)*(end - start)//2 for start, end in self.observable_windows)
+
+    # Airmass at every observable time step, in order
+    @property
+    def observable_airmass(self):
+        return np.concatenate([np.empty(0)] + [self.airmass_segment(start, end) for start, end in self.observable_windows])
+
+    def airmass_segment(self, start, end):
+        return self.catalog.airmass(self.index, slice(start, end))
+
+    # The whole night, every step_size-th step (e.g. to plot the airmass track)
+    def airmass_curve(self, step_size=1):
+        return self.catalog.airmass(self.index, slice(None, None, step_size))
+
+    @property
+    def raw_airmass_array(self):
+        return self.airmass_curve()
+
+    # Built on demand; only needed when writing schedules
+    @property
+    def coord(self):
+        from astropy.coordinates import SkyCoord
+        from astropy import units as unit
+        return SkyCoord(ra=self.catalog.ra[self.index], dec=self.catalog.dec[self.index], unit=(unit.rad, unit.rad))
+
+
+# Airmass for every target at every time step in one pass: rows are targets, columns are
+# the entries of sidereal_radian_array. Out-of-range values are flagged with 9999.
+def compute_airmass_matrix(ra_radians, dec_radians, observatory_lat, sidereal_radian_array):
+    RA = np.asarray(ra_radians, dtype=float)[:, np.newaxis]
+    DEC = np.asarray(dec_radians, dtype=float)[:, np.newaxis]
+    LST = np.asarray(sidereal_radian_array, dtype=float)[np.newaxis, :]
+
+    return airmass_values(RA, DEC, float(observatory_lat), LST)
+
+# compute_airmass_matrix encoded for airmass_storage, a block of targets at a time so the full
+# float64 matrix is never held
+def compute_compact_airmass_matrix(ra_radians, dec_radians, observatory_lat, sidereal_radian_array, airmass_storage, block_size=4096):
+    dtype, scale = airmass_storage_types[airmass_storage]
+    codes = np.empty((len(ra_radians), len(sidereal_radian_array)), dtype=dtype)
+    for begin in range(0, len(ra_radians), block_size):
+        end = begin + block_size
+        codes[begin:end] = encode_airmass(compute_airmass_matrix(ra_radians[begin:end], dec_radians[begin:end], observatory_lat, \
+                                                                 sidereal_radian_array), airmass_storage)
+
+    return codes
+
+def encode_airmass(airmass, airmass_storage):
+    dtype, scale = airmass_storage_types[airmass_storage]
+    if not np.issubdtype(dtype, np.integer):
+        return airmass.astype(dtype)
+
+    codes = np.round(np.minimum(airmass, 9999)*scale)
+    observable = airmass <= Constants.airmass_threshold
+    codes[observable] = np.minimum(codes[observable], np.floor(Constants.airmass_threshold*scale))
+    codes[airmass >= 9999] = np.iinfo(dtype).max
+    return codes.astype(dtype)
+
+def decode_airmass(codes, airmass_storage):
+    dtype, scale = airmass_storage_types[airmass_storage]
+    airmass = codes.astype(float)
+    if np.issubdtype(dtype, np.integer):
+        airmass /= scale
+        airmass[codes == np.iinfo(dtype).max] = 9999
+    return airmass
+
+# Airmass at broadcastable RA/DEC/LST (radians). Every airmass in the scheduler goes through here,
+# so values computed for a window match the full-night ones exactly.
+def airmass_values(RA, DEC, LAT, LST):
+    # Evaluated in place in a single buffer to keep peak memory down
+    am = LST - RA # hour angle
+    np.cos(am, out=am)
+    am *= np.cos(DEC)*np.cos(LAT)
+    am += np.sin(DEC)*np.sin(LAT)
+    np.arcsin(am, out=am)
+    np.sin(am, out=am)
+    np.reciprocal(am, out=am)
+
+    am[(am > 3.0) | (am < 1.0)] = 9999
+
+    return am
+
+# Time steps where each target's airmass is within airmass_threshold, as two [start, end) windows
+# per target (the second is empty unless the target sets and rises again within the night).
+# Found in closed form: the target is within the threshold while |hour angle| <= h_limit (see
+# observable_in_night) and the hour angle advances by a fixed amount per step. The window edges
+# are then checked against the sampled airmass, so the windows match
+# compute_airmass_matrix(...) <= airmass_threshold step for step.
+def observable_windows(ra_radians, dec_radians, observatory_lat, sidereal_radian_array, airmass_threshold):
+    RA = np.asarray(ra_radians, dtype=float)
+    DEC = np.asarray(dec_radians, dtype=float)
+    LAT = float(observatory_lat)
+    LST = np.asarray(sidereal_radian_array, dtype=float)
+    num_steps = len(LST)
+    two_pi = 2.0*np.pi
+
+    starts = np.zeros((len(RA), 2), dtype=np.int64)
+    ends = np.zeros((len(RA), 2), dtype=np.int64)
+    if len(RA) == 0 or num_steps == 0:
+        return starts, ends
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cos_limit = (1.0/airmass_threshold - np.sin(DEC)*np.sin(LAT))/(np.cos(DEC)*np.cos(LAT))
+    rises = cos_limit <= 1.0 + 1e-12
+    never_sets = cos_limit <= -1.0
+    h_limit = np.arccos(np.clip(cos_limit, -1.0, 1.0)) + 1e-9
+
+    ha_step = np.mod(LST[1] - LST[0], two_pi) if num_steps > 1 else two_pi # hour angle per time step
+    ha_start = np.mod(LST[0] - RA + np.pi, two_pi) - np.pi # hour angle at the first step
+
+    # The night spans less than a sidereal day, so it meets at most two turns of [-h_limit, h_limit]
+    for turn in range(2):
+        with np.errstate(invalid="ignore"):
+            starts[:, turn] = np.clip(np.ceil((two_pi*turn - h_limit - ha_start)/ha_step), 0, num_steps)
+            ends[:, turn] = np.clip(np.floor((two_pi*turn + h_limit - ha_start)/ha_step) + 1, 0, num_steps)
+    ends = np.where(rises[:, np.newaxis], np.maximum(ends, starts), starts)
+    starts[never_sets] = [0, 0]
+    ends[never_sets] = [num_steps, 0]
+
+    def observable(steps):
+        return airmass_values(RA, DEC, LAT, LST[np.clip(steps, 0, num_steps - 1)]) <= airmass_threshold
+
+    # Move each edge onto the sampled threshold crossing (at most a step or so away)
+    for turn in range(2):
+        start, end = starts[:, turn], ends[:, turn]
+        moved = True
+        while moved:
+            shrink_start = (end > start) & ~observable(start)
+            start += shrink_start
+            shrink_end = (end > start) & ~observable(end - 1)
+            end -= shrink_end
+            grow_start = (end > start) & (start > 0) & observable(start - 1)
+            start -= grow_start
+            grow_end = (end > start) & (end < num_steps) & observable(end)
+            end += grow_end
+            moved = np.any(shrink_start | shrink_end | grow_start | grow_end)
+
+    # Windows that meet (a target that never sets) are one window
+    merge = (ends[:, 0] > starts[:, 0]) & (ends[:, 1] > starts[:, 1]) & (starts[:, 1] <= ends[:, 0])
+    ends[merge, 0] = np.maximum(ends[merge, 0], ends[merge, 1])
+    starts[merge, 1] = ends[merge, 1] = 0
+
+    return starts, ends
+
+# Closed-form observability test, with no per-step work: a target is within airmass_threshold while
+# |hour angle| <= h_limit, where cos(h_limit) = (1/airmass_threshold - sin(DEC)sin(LAT))/(cos(DEC)cos(LAT)),
+# and the night covers hour angles LST[0] - RA through LST[-1] - RA. False for targets that never
+# reach the threshold during the night.
+def observable_in_night(ra_radians, dec_radians, observatory_lat, sidereal_radian_array, airmass_threshold, tolerance=1e-6):
+    RA = np.asarray(ra_radians, dtype=float)
+    DEC = np.asarray(dec_radians, dtype=float)
+    LAT = float(observatory_lat)
+    two_pi = 2.0*np.pi
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cos_limit = (1.0/airmass_threshold - np.sin(DEC)*np.sin(LAT))/(np.cos(DEC)*np.cos(LAT))
+    never_rises = cos_limit > 1.0 + tolerance # declination bound
+    never_sets = cos_limit <= -1.0
+    h_limit = np.arccos(np.clip(cos_limit, -1.0, 1.0)) + tolerance
+
+    night_start = np.mod(sidereal_radian_array[0] - RA + np.pi, two_pi) - np.pi # hour angle at the first step
+    night_span = np.mod(sidereal_radian_array[-1] - sidereal_radian_array[0], two_pi)
+
+    # The arcs [night_start, night_start + night_span] and [-h_limit, h_limit] overlap if either starts inside the other
+    overlaps = (np.mod(-h_limit - night_start, two_pi) <= night_span) | (np.mod(night_start + h_limit, two_pi) <= 2.0*h_limit)
+
+    return ~never_rises & (never_sets | overlaps)
@@ -1,9 +1,12 @@
 import Constants
-from Target import TargetType, Target
+from Target import TargetType, Target, catalog_values
 
 from abc import ABCMeta, abstractmethod, abstractproperty
 import numpy as np
 import csv
+import logging
+
+log = logging.getLogger(__name__)
 
 # Abstract class -- not meant to be directly instantiated. Inherit from this class to implement
 # another telescope. See Swope and Nickel implementations...
@@ -18,13 +21,115 @@ class Telescope(metaclass=ABCMeta):
 		pass
 	
 	@abstractmethod
-	def compute_exposures(self):
+	def compute_exposures(self, targets=None):
 		pass
 	
-	@abstractmethod
-	def write_schedule(self, observatory_name, obs_date, good_targets):
-		pass
+	# Operator CSV of a night's targets, in observing order: an acquisition row in the first filter,
+	# then one row per filter (see filter_sequences). With archive (a ScheduleArchive), the night's
+	# placements are also appended to it.
+	def write_schedule(self, observatory_name, obs_date, targets, archive=None):
+		sequences = self.filter_sequences(targets)
+
+		file_to_write = self.schedule_file_name(observatory_name, obs_date)
+		with open(file_to_write,"w") as csvoutput:
+			writer = csv.writer(csvoutput, lineterminator="\n")
+
+			output_rows = []
+			output_rows.append(["Object Name", "Right Ascension", "Declination", "Estimated Magnitude", "Filter", "Exposure Time"])
+
+			for t, sequence in zip(targets, sequences):
+				ra = t.coord.ra.hms
+				dec = t.coord.dec.dms
+
+				tgt_row = []
+				tgt_row.append(t.name)
+				tgt_row.append("=\"%02d:%02d:%0.1f\"" % (ra[0],ra[1],ra[2]))
+				tgt_row.append("=\"%02d:%02d:%0.1f\"" % (dec[0],np.abs(dec[1]),np.abs(dec[2])))
+				tgt_row.append(None)
+				tgt_row.append(sequence[0])
+				tgt_row.append(self.acquisition_exposures.get(sequence[0], 10)) # Acquisition in the first filter
+				output_rows.append(tgt_row)
+
+				for f in sequence:
+					output_rows.append([None, None, None, None, f, t.exposures[f]])
+
+			writer.writerows(output_rows)
+
+		if archive is not None:
+			archive.append_schedule(observatory_name, self.name, obs_date, targets, sequences)
 	
+	def schedule_file_name(self, observatory_name, obs_date):
+		return "%s_%s_%s_GoodSchedule.csv" % (observatory_name, self.name, obs_date.strftime('%Y%m%d'))
+
+	# JSON run report (see RunMetrics), written next to the schedule
+	def report_file_name(self, observatory_name, obs_date):
+		return "%s_%s_%s_RunReport.json" % (observatory_name, self.name, obs_date.strftime('%Y%m%d'))
+
+	# Overhead model, driven by per-telescope parameters set in __init__: slews at slew_rate (deg/s)
+	# plus slew_settle (s), acquisition (s) per target, readout (s) per exposure and filter_change (s)
+	# per filter move. Blocks are first sized with a slew of nominal_slew_deg, since the previous
+	# target is only known once the night has been placed (see Observatory.tighten_schedule).
+	def slew_seconds(self, separation_deg):
+		return separation_deg/self.slew_rate + self.slew_settle
+
+	def block_seconds(self, exposures):
+		num_exps = len(exposures)
+		return self.slew_seconds(self.nominal_slew_deg) + self.acquisition + sum(exposures.values()) + \
+			   num_exps*self.readout + max(num_exps - 1, 0)*self.filter_change
+
+	# A target's filters in wheel order (self.filter_order), run forwards or backwards: whichever
+	# starts closest on the wheel to the filter left in place by the previous target
+	def filter_sequence(self, exposures, last_filter=None):
+		sequence = [f for f in self.filter_order if f in exposures]
+		if last_filter in self.filter_order and len(sequence) > 1:
+			wheel_position = self.filter_order.index
+			if abs(wheel_position(sequence[-1]) - wheel_position(last_filter)) < \
+			   abs(wheel_position(sequence[0]) - wheel_position(last_filter)):
+				sequence.reverse()
+
+		return sequence
+
+	# Each target's filter_sequence, in observing order: every target runs its filters in the
+	# direction that saves a filter change after the previous one
+	def filter_sequences(self, targets):
+		sequences = []
+		last_filter = self.filter_order[0]
+		for t in targets:
+			sequence = self.filter_sequence(t.exposures, last_filter)
+			sequences.append(sequence)
+			last_filter = sequence[-1] if len(sequence) > 0 else last_filter
+
+		return sequences
+
+	def filter_changes(self, sequence, last_filter):
+		return sum(1 for a, b in zip([last_filter] + sequence, sequence) if a != b)
+
+	# Length (s) of a placed block: a slew of slew_deg, then the filters in sequence starting from
+	# last_filter (the one left in place by the previous target)
+	def sequence_block_seconds(self, exposures, sequence, last_filter, slew_deg):
+		return self.slew_seconds(slew_deg) + self.acquisition + sum(exposures.values()) + \
+			   len(sequence)*self.readout + self.filter_changes(sequence, last_filter)*self.filter_change
+
+	# Modeled dead time (s) of a night's targets, in observing order: slews between neighbours,
+	# acquisition, readouts and filter changes
+	def sequence_dead_time(self, targets):
+		dead_time = 0.0
+		last_filter = self.filter_order[0]
+		previous = None
+
+		for t in targets:
+			sequence = self.filter_sequence(t.exposures, last_filter)
+			if previous is not None:
+				dead_time += self.slew_seconds(angular_separation(previous, t))
+
+			dead_time += self.acquisition + len(sequence)*self.readout + \
+						 self.filter_changes(sequence, last_filter)*self.filter_change
+
+			last_filter = sequence[-1] if len(sequence) > 0 else last_filter
+			previous = t
+
+		return dead_time
+
 	def round_to_num(self, round_to_num, input_to_round):
 		return int(round_to_num*round(float(input_to_round)/round_to_num))
 	
@@ -35,18 +140,91 @@ class Telescope(metaclass=ABCMeta):
 		
 		return exp_time
 	
+	# Batch exposure engine: S/N-driven exposure times (s) for every target and every filter in
+	# self.filters at once, as a (targets x filters) table with NaN where a filter is not taken.
+	# Applies the same rules as the per-type compute_*_exposure functions (the reference
+	# implementation), driven by each telescope's sn_filters/young_sn_filters/sn_mean_filters/
+	# gw_filters/template_exposures. Also returns a per-target flag for whole-second (int) exposures.
+	def compute_exposure_table(self, targets):
+		filter_names = list(self.filters.keys())
+		zeropoints = np.asarray([self.filters[f] for f in filter_names])
+		column = {f: i for i, f in enumerate(filter_names)}
+
+		n = len(targets)
+		types = catalog_values(targets, "type")
+		apparent_mag = catalog_values(targets, "apparent_mag")
+		exposures = np.full((n, len(filter_names)), np.nan)
+		is_int = np.zeros(n, dtype=bool)
+
+		# Supernovae: S/N and expected fading depend on phase
+		sn = types == TargetType.Supernova.value
+		if np.any(sn):
+			obs_date = np.datetime64(targets[0].obs_date, 's')
+			days_from_disc = (obs_date - catalog_values(targets, "disc_date")[sn]) // np.timedelta64(1, 'D')
+			adj_app_mag = apparent_mag[sn] + days_from_disc*0.03
+			s_to_n = np.select([days_from_disc <= 10, days_from_disc <= 60], [30, 20], 10)
+
+			sn_exp = self.time_to_S_N(s_to_n[:, np.newaxis], adj_app_mag[:, np.newaxis], zeropoints[np.newaxis, :])
+			sn_table = Constants.round_to*np.round(sn_exp/Constants.round_to)
+			young = days_from_disc < 60
+
+			if len(self.sn_mean_filters) > 0:
+				mean_exp = np.mean(sn_exp[:, [column[f] for f in self.sn_mean_filters]], axis=1)
+				sn_table[:, [column[f] for f in self.sn_mean_filters]] = \
+					(Constants.round_to*np.round(mean_exp/Constants.round_to))[:, np.newaxis]
+
+			# Only include these exposures if a relatively new SN
+			keep = np.zeros(sn_table.shape, dtype=bool)
+			keep[:, [column[f] for f in self.sn_filters]] = True
+			keep[np.ix_(young, [column[f] for f in self.young_sn_filters])] = True
+
+			# Finally, don't go less than 45s (~ readout time), don't go more than 600s
+			exposures[sn] = np.where(keep, np.clip(sn_table, 45, 600), np.nan)
+			is_int[sn] = True
+
+		std = types == TargetType.Standard.value
+		if np.any(std):
+			std_exp = self.time_to_S_N(100, apparent_mag[std][:, np.newaxis], zeropoints[np.newaxis, :])
+			exposures[std] = np.clip(Constants.round_to*np.round(std_exp/Constants.round_to), 10, 600)
+			is_int[std] = True
+
+		tmp = types == TargetType.Template.value
+		for f, exp_time in self.template_exposures.items():
+			exposures[tmp, column[f]] = exp_time
+		is_int[tmp] = True
+
+		gw_columns = [column[f] for f in self.gw_filters]
+
+		gw_static = types == TargetType.GW_Static.value
+		static_exp_time = catalog_values(targets, "static_exp_time")[gw_static]
+		static_exp_time = np.where(np.isnan(static_exp_time), 120, static_exp_time) # default to 120 seconds
+		exposures[np.ix_(gw_static, gw_columns)] = static_exp_time[:, np.newaxis]
+
+		gw_dynamic = types == TargetType.GW_Dynamic.value
+		if np.any(gw_dynamic):
+			App_Mag = catalog_values(targets, "est_abs_mag")[gw_dynamic] + \
+					  5.0*np.log10(catalog_values(targets, "host_dist_mpc")[gw_dynamic]*1.e6) - 5.0
+			exposures[np.ix_(gw_dynamic, gw_columns)] = \
+				self.time_to_S_N(30., App_Mag[:, np.newaxis], zeropoints[np.newaxis, gw_columns])
+
+		return exposures, is_int
+
+	# One row of the exposure table as the filter:seconds dictionary stored on each Target
+	def exposure_dict(self, exposure_row, is_int):
+		return {f: (int(e) if is_int else float(e)) for f, e in zip(self.filters.keys(), exposure_row) if not np.isnan(e)}
+
 	def compute_net_priorities(self):
 		
 		targets = self.get_targets()
 		
 		total_p = np.sum([t.priority for t in targets])
-		print("Total Priority: %s" % total_p)
+		log.debug("Total Priority: %s", total_p)
 
 		total_good_time = np.sum([t.total_observable_min for t in targets])
-		print("Total Good Time: %s" % total_good_time)
+		log.debug("Total Good Time: %s", total_good_time)
 
 		total_exp_time = np.sum([t.total_minutes for t in targets])
-		print("Total Exposure Time: %s" % total_exp_time)
+		log.debug("Total Exposure Time: %s", total_exp_time)
 
 		total_prob = 0
 		if (total_p > 0 and total_good_time > 0 and total_exp_time > 0):
@@ -67,9 +245,17 @@ class Telescope(metaclass=ABCMeta):
 				frac_exp_time = (1.0-float(t.total_minutes)/float(total_exp_time))
 
 				t.net_priority = (frac_p*frac_time*frac_exp_time)/total_prob
-				print("Nat: %s; Net: %0.5f" % (t.priority, t.net_priority))
+				log.debug("Nat: %s; Net: %0.5f", t.priority, t.net_priority)
 		else:
-			print("No valid targets...")
+			log.warning("No valid targets...")
+
+# Great-circle distance (degrees) between two targets
+def angular_separation(tgt1, tgt2):
+	ra1, dec1 = tgt1.catalog.ra[tgt1.index], tgt1.catalog.dec[tgt1.index]
+	ra2, dec2 = tgt2.catalog.ra[tgt2.index], tgt2.catalog.dec[tgt2.index]
+	cos_sep = np.sin(dec1)*np.sin(dec2) + np.cos(dec1)*np.cos(dec2)*np.cos(ra1 - ra2)
+
+	return np.degrees(np.arccos(np.clip(cos_sep, -1.0, 1.0)))
 
 # Used with Las Campanas Observatory
 class Swope(Telescope):
@@ -87,6 +273,30 @@ class Swope(Telescope):
 			Constants.i_band:23.131884
 		}
 
+		# Filters used by the batch exposure engine (compute_exposure_table)
+		self.sn_filters = [Constants.g_band, Constants.r_band, Constants.i_band]
+		self.young_sn_filters = [Constants.u_band, Constants.B_band, Constants.V_band]
+		self.sn_mean_filters = [Constants.V_band, Constants.g_band, Constants.r_band, Constants.i_band] # Vgri share one exposure
+		self.gw_filters = [Constants.g_band, Constants.i_band]
+		self.template_exposures = {
+			Constants.u_band: 1800,
+			Constants.B_band: 1800,
+			Constants.V_band: 1200,
+			Constants.g_band: 1200,
+			Constants.r_band: 1200,
+			Constants.i_band: 1200
+		}
+
+		# Overhead model (see Telescope.block_seconds)
+		self.filter_order = [Constants.r_band, Constants.i_band, Constants.g_band, Constants.u_band, Constants.V_band, Constants.B_band]
+		self.acquisition_exposures = {Constants.B_band: 20} # seconds; other filters take 10
+		self.slew_rate = 1.5 # deg/s
+		self.slew_settle = 15
+		self.nominal_slew_deg = 30
+		self.acquisition = 60
+		self.readout = 30
+		self.filter_change = 15
+
 		self.exp_funcs = {
 			TargetType.Supernova: self.compute_sn_exposure,
 			TargetType.Template: self.compute_template_exposure,
@@ -106,7 +316,7 @@ class Swope(Telescope):
 		
 		exp_time = 120 # default to 120 seconds
 
-		if GW_Static.static_exp_time is not None:
+		if GW_Static.static_exp_time is not None and not np.isnan(GW_Static.static_exp_time):
 			exp_time = GW_Static.static_exp_time
 			
 		exposures.update({Constants.g_band: exp_time})
@@ -120,7 +330,7 @@ class Swope(Telescope):
 		App_Mag = GW_Dynamic.est_abs_mag + 5.0*np.log10(GW_Dynamic.host_dist_mpc*1.e6) - 5.0
 		#The reason I need to multiply Mpc by 1e5 is the log base 10 implies a need to divide by 10.
 
-		print(App_Mag)
+		log.debug("%s App_Mag: %s", GW_Dynamic.name, App_Mag)
 		#We need to compute App_Mag with above function, and assume a Signal to noise value of 30:
 
 		s_to_n = 30.
@@ -133,7 +343,7 @@ class Swope(Telescope):
 
 		GW_Dynamic.exposures = exposures
 		
-		print(exposures)
+		log.debug("%s exposures: %s", GW_Dynamic.name, exposures)
 	
 	def compute_sn_exposure(self, sn):
 		exposures = {}
@@ -181,12 +391,12 @@ class Swope(Telescope):
 		s_to_n = 100
 		
 		# Don't know what the apparent mag should be?
-		exposures.update({Constants.u_band: self.round_to_num(Constants.round_to, self.time_to_S_N(s_to_n, std.ApparentMag, self.filters[Constants.u_band]))})
-		exposures.update({Constants.B_band: self.round_to_num(Constants.round_to, self.time_to_S_N(s_to_n, std.ApparentMag, self.filters[Constants.B_band]))})
-		exposures.update({Constants.V_band: self.round_to_num(Constants.round_to, self.time_to_S_N(s_to_n, std.ApparentMag, self.filters[Constants.V_band]))})
-		exposures.update({Constants.g_band: self.round_to_num(Constants.round_to, self.time_to_S_N(s_to_n, std.ApparentMag, self.filters[Constants.g_band]))})
-		exposures.update({Constants.r_band: self.round_to_num(Constants.round_to, self.time_to_S_N(s_to_n, std.ApparentMag, self.filters[Constants.r_band]))})
-		exposures.update({Constants.i_band: self.round_to_num(Constants.round_to, self.time_to_S_N(s_to_n, std.ApparentMag, self.filters[Constants.i_band]))})
+		exposures.update({Constants.u_band: self.round_to_num(Constants.round_to, self.time_to_S_N(s_to_n, std.apparent_mag, self.filters[Constants.u_band]))})
+		exposures.update({Constants.B_band: self.round_to_num(Constants.round_to, self.time_to_S_N(s_to_n, std.apparent_mag, self.filters[Constants.B_band]))})
+		exposures.update({Constants.V_band: self.round_to_num(Constants.round_to, self.time_to_S_N(s_to_n, std.apparent_mag, self.filters[Constants.V_band]))})
+		exposures.update({Constants.g_band: self.round_to_num(Constants.round_to, self.time_to_S_N(s_to_n, std.apparent_mag, self.filters[Constants.g_band]))})
+		exposures.update({Constants.r_band: self.round_to_num(Constants.round_to, self.time_to_S_N(s_to_n, std.apparent_mag, self.filters[Constants.r_band]))})
+		exposures.update({Constants.i_band: self.round_to_num(Constants.round_to, self.time_to_S_N(s_to_n, std.apparent_mag, self.filters[Constants.i_band]))})
 		
 		# Finally, for standards round exps and don't go less than 10s, don't go more than 600s on Swope
 		# Round to nearest "exp_round_to" secs
@@ -209,124 +419,29 @@ class Swope(Telescope):
 		
 		tmp.exposures = exposures
 	
-	def compute_exposures(self):
-		for tgt in self.targets:			
+	# targets: optional subset (e.g. newly added targets); defaults to all of them
+	def compute_exposures(self, targets=None):
+		targets = self.targets if targets is None else targets
+		exposure_table, is_int = self.compute_exposure_table(targets)
+
+		for tgt, exposure_row, row_is_int in zip(targets, exposure_table, is_int):
 			
-			total_possible_time = np.sum(np.where(tgt.raw_airmass_array <= Constants.airmass_threshold)[0])
+			total_possible_time = tgt.observable_minutes
 			
 			if total_possible_time > 0:
-				tgt.total_observable_min = int(total_possible_time)
+				tgt.total_observable_min = total_possible_time
 				
-				self.exp_funcs[tgt.type](tgt) # Sets exposures for each target by target type
+				tgt.exposures = self.exposure_dict(exposure_row, row_is_int) # Exposures for each target by target type
 				
-				# per observatory - LCO Swope
-				fudge_factor = 400 if len(tgt.exposures) > 3 else 300 # Build in a fudge factor based on # of exps
-				tgt.total_minutes = int(round((sum(tgt.exposures.values()) + fudge_factor)/60)) # Sum total minutes
+				tgt.total_minutes = int(round(self.block_seconds(tgt.exposures)/60)) # Exposures plus modeled overheads
 			
-			good_airmass = tgt.raw_airmass_array[np.asarray(np.where(tgt.raw_airmass_array <= Constants.airmass_threshold))]
-			integrated_good_am = np.sum(good_airmass)
+			integrated_good_am = np.sum(tgt.observable_airmass)
 			
 			if integrated_good_am > 0:
 				tgt.total_good_air_mass = integrated_good_am
 
 			if tgt.total_observable_min > 0:
 				tgt.fraction_time_obs = float(tgt.total_minutes)/float(tgt.total_observable_min)
-				
-	def swope_filter_row(self, exp_name, exp_time):
-		filter_row = []
-		filter_row.append(None)
-		filter_row.append(None)
-		filter_row.append(None)
-		filter_row.append(None)
-		filter_row.append(exp_name)
-		filter_row.append(exp_time)
-		
-		return filter_row
-		
-	def write_schedule(self, observatory_name, obs_date, targets):
-		
-		file_to_write = "%s_%s_%s_GoodSchedule.csv" % (observatory_name, self.name, obs_date.strftime('%Y%m%d'))
-		with open(file_to_write,"w") as csvoutput:
-			writer = csv.writer(csvoutput, lineterminator="\n")
-
-			output_rows = []
-			header_row = []
-			header_row.append("Object Name")
-			header_row.append("Right Ascension")
-			header_row.append("Declination")
-			header_row.append("Estimated Magnitude")
-			header_row.append("Filter")
-			header_row.append("Exposure Time")
-			output_rows.append(header_row)
-
-			last_filter = Constants.r_band
-			for t in targets:
-				ra = t.coord.ra.hms
-				dec = t.coord.dec.dms
-
-				tgt_row = []
-				tgt_row.append(t.name)
-				tgt_row.append("=\"%02d:%02d:%0.1f\"" % (ra[0],ra[1],ra[2]))
-				tgt_row.append("=\"%02d:%02d:%0.1f\"" % (dec[0],np.abs(dec[1]),np.abs(dec[2])))
-				tgt_row.append(None)
-
-				# Last criterion: if previous obj had full 6 filters, but this target only has 3
-				if (last_filter == Constants.r_band) or \
-				   (last_filter == Constants.i_band) or \
-					(last_filter == Constants.g_band) or \
-					(last_filter == Constants.B_band and len(t.exposures) < 6):
-
-					tgt_row.append(Constants.r_band)
-					tgt_row.append(10) # Acquisition in r
-					output_rows.append(tgt_row)
-
-					# Start in riguVB order
-					if Constants.r_band in t.exposures:
-						output_rows.append(self.swope_filter_row(Constants.r_band, t.exposures[Constants.r_band]))
-
-					if Constants.i_band in t.exposures:
-						output_rows.append(self.swope_filter_row(Constants.i_band, t.exposures[Constants.i_band]))
-					
-					if Constants.g_band in t.exposures:
-						output_rows.append(self.swope_filter_row(Constants.g_band, t.exposures[Constants.g_band]))
-					
-					last_filter = Constants.g_band
-
-					if len(t.exposures) > 3:
-
-						if Constants.u_band in t.exposures:
-							output_rows.append(self.swope_filter_row(Constants.u_band, t.exposures[Constants.u_band]))
-
-						if Constants.V_band in t.exposures:
-							output_rows.append(self.swope_filter_row(Constants.V_band, t.exposures[Constants.V_band]))
-
-						if Constants.B_band in t.exposures:
-							output_rows.append(self.swope_filter_row(Constants.B_band, t.exposures[Constants.B_band]))
-
-						last_filter = Constants.B_band
-					#This last_filter business is now complicated... 
-				# Flip order: BVugir
-				else:
-					tgt_row.append(Constants.B_band)
-					tgt_row.append(20) # Acquisition in B
-					output_rows.append(tgt_row)
-
-					if Constants.B_band in t.exposures:
-						output_rows.append(self.swope_filter_row(Constants.B_band, t.exposures[Constants.B_band]))
-					if Constants.V_band in t.exposures:
-						output_rows.append(self.swope_filter_row(Constants.V_band, t.exposures[Constants.V_band]))
-					if Constants.u_band in t.exposures:
-						output_rows.append(self.swope_filter_row(Constants.u_band, t.exposures[Constants.u_band]))
-					if Constants.g_band in t.exposures:
-						output_rows.append(self.swope_filter_row(Constants.g_band, t.exposures[Constants.g_band]))
-					if Constants.i_band in t.exposures:
-						output_rows.append(self.swope_filter_row(Constants.i_band, t.exposures[Constants.i_band]))
-					if Constants.r_band in t.exposures:
-						output_rows.append(self.swope_filter_row(Constants.r_band, t.exposures[Constants.r_band]))
-					
-					last_filter = Constants.r_band
-					
-			writer.writerows(output_rows)
 
 
 # Used with Lick Observatory
@@ -342,6 +457,29 @@ class Nickel(Telescope):
 			Constants.r_prime:22.81,
 			Constants.i_prime:22.65
 		}
+
+		# Filters used by the batch exposure engine (compute_exposure_table)
+		self.sn_filters = [Constants.r_prime, Constants.i_prime]
+		self.young_sn_filters = [Constants.B_band, Constants.V_band]
+		self.sn_mean_filters = []
+		self.gw_filters = [Constants.B_band, Constants.V_band]
+		self.template_exposures = {
+			Constants.B_band: 1800,
+			Constants.V_band: 1200,
+			Constants.r_prime: 1200,
+			Constants.i_prime: 1200
+		}
+
+		# Overhead model (see Telescope.block_seconds)
+		self.filter_order = [Constants.r_prime, Constants.i_prime, Constants.V_band, Constants.B_band]
+		self.acquisition_exposures = {Constants.B_band: 20} # seconds; other filters take 10
+		self.slew_rate = 2.0 # deg/s
+		self.slew_settle = 10
+		self.nominal_slew_deg = 30
+		self.acquisition = 30
+		self.readout = 15
+		self.filter_change = 5
+
 		self.exp_funcs = {
 			TargetType.Supernova: self.compute_sn_exposure,
 			TargetType.Template: self.compute_template_exposure,
@@ -361,7 +499,7 @@ class Nickel(Telescope):
 		
 		exp_time = 120 # default to 120 seconds
 
-		if GW_Static.static_exp_time is not None:
+		if GW_Static.static_exp_time is not None and not np.isnan(GW_Static.static_exp_time):
 			exp_time = GW_Static.static_exp_time
 			
 		exposures.update({Constants.B_band: exp_time})
@@ -426,10 +564,10 @@ class Nickel(Telescope):
 		s_to_n = 100
 		
 		# Don't know what the apparent mag should be?
-		exposures.update({Constants.r_prime: self.round_to_num(Constants.round_to, self.time_to_S_N(s_to_n, std.ApparentMag, self.filters[Constants.r_prime]))})
-		exposures.update({Constants.i_prime: self.round_to_num(Constants.round_to, self.time_to_S_N(s_to_n, std.ApparentMag, self.filters[Constants.i_prime]))})
-		exposures.update({Constants.B_band: self.round_to_num(Constants.round_to, self.time_to_S_N(s_to_n, std.ApparentMag, self.filters[Constants.B_band]))})
-		exposures.update({Constants.V_band: self.round_to_num(Constants.round_to, self.time_to_S_N(s_to_n, std.ApparentMag, self.filters[Constants.V_band]))})
+		exposures.update({Constants.r_prime: self.round_to_num(Constants.round_to, self.time_to_S_N(s_to_n, std.apparent_mag, self.filters[Constants.r_prime]))})
+		exposures.update({Constants.i_prime: self.round_to_num(Constants.round_to, self.time_to_S_N(s_to_n, std.apparent_mag, self.filters[Constants.i_prime]))})
+		exposures.update({Constants.B_band: self.round_to_num(Constants.round_to, self.time_to_S_N(s_to_n, std.apparent_mag, self.filters[Constants.B_band]))})
+		exposures.update({Constants.V_band: self.round_to_num(Constants.round_to, self.time_to_S_N(s_to_n, std.apparent_mag, self.filters[Constants.V_band]))})
 		
 		# Finally, don't go less than 10s for Nickel std, don't go more than 600s on Nickel
 		for key, value in exposures.items():
@@ -451,94 +589,25 @@ class Nickel(Telescope):
 		tmp.exposures = exposures
 
 	
-	def compute_exposures(self):
-		for tgt in self.targets:			
+	# targets: optional subset (e.g. newly added targets); defaults to all of them
+	def compute_exposures(self, targets=None):
+		targets = self.targets if targets is None else targets
+		exposure_table, is_int = self.compute_exposure_table(targets)
+
+		for tgt, exposure_row, row_is_int in zip(targets, exposure_table, is_int):
 			
-			total_possible_time = np.sum(np.where(tgt.raw_airmass_array <= Constants.airmass_threshold)[0])
+			total_possible_time = tgt.observable_minutes
 			
 			if total_possible_time > 0:
 				tgt.total_observable_min = total_possible_time
 				
-				self.exp_funcs[tgt.type](tgt) # Sets exposures for each target by target type
+				tgt.exposures = self.exposure_dict(exposure_row, row_is_int) # Exposures for each target by target type
 				
-				# per observatory - estimatation for Lick Nickel
-				fudge_factor = 200 if len(tgt.exposures) > 2 else 100 # Build in a fudge factor based on # of exps
-				tgt.total_minutes = round((sum(tgt.exposures.values()) + fudge_factor)/60) # Sum total minutes
+				tgt.total_minutes = int(round(self.block_seconds(tgt.exposures)/60)) # Exposures plus modeled overheads
 			
-			good_airmass = tgt.raw_airmass_array[np.asarray(np.where(tgt.raw_airmass_array <= Constants.airmass_threshold))]
-			integrated_good_am = np.sum(good_airmass)
+			integrated_good_am = np.sum(tgt.observable_airmass)
 			if integrated_good_am > 0:
 				tgt.total_good_air_mass = integrated_good_am
 
 			if tgt.total_observable_min > 0:
 				tgt.fraction_time_obs = float(tgt.total_minutes)/float(tgt.total_observable_min)
-
-	def nickel_filter_row(self, exp_name, exp_time):
-		filter_row = []
-		filter_row.append(None)
-		filter_row.append(None)
-		filter_row.append(None)
-		filter_row.append(None)
-		filter_row.append(exp_name)
-		filter_row.append(exp_time)
-		
-		return filter_row
-				
-	def write_schedule(self, observatory_name, obs_date, targets):		
-		file_to_write = "%s_%s_%s_GoodSchedule.csv" % (observatory_name, self.name, obs_date.strftime('%Y%m%d'))
-		with open(file_to_write,"w") as csvoutput:
-			writer = csv.writer(csvoutput, lineterminator="\n")
-
-			output_rows = []
-			header_row = []
-			header_row.append("Object Name")
-			header_row.append("Right Ascension")
-			header_row.append("Declination")
-			header_row.append("Estimated Magnitude")
-			header_row.append("Filter")
-			header_row.append("Exposure Time")
-			output_rows.append(header_row)
-
-			last_filter = Constants.r_prime
-			for t in targets:				
-				ra = t.coord.ra.hms
-				dec = t.coord.dec.dms
-
-				tgt_row = []
-				tgt_row.append(t.name)
-				tgt_row.append("=\"%02d:%02d:%0.1f\"" % (ra[0],ra[1],ra[2]))
-				tgt_row.append("=\"%02d:%02d:%0.1f\"" % (dec[0],np.abs(dec[1]),np.abs(dec[2])))
-				tgt_row.append(None)
-
-				# Last criterion: if previous obj had full 4 filters, but this target only has 2
-				if (last_filter == Constants.r_prime) or \
-				   (last_filter == Constants.i_prime) or \
-					(last_filter == Constants.B_band and len(t.exposures) < 4):
-
-					tgt_row.append(Constants.r_prime)
-					tgt_row.append(10) # Acquisition in r'
-					output_rows.append(tgt_row)
-
-					# Start in r'i'VB order
-					output_rows.append(self.nickel_filter_row(Constants.r_prime, t.exposures[Constants.r_prime]))
-					output_rows.append(self.nickel_filter_row(Constants.i_prime, t.exposures[Constants.i_prime]))
-					last_filter = Constants.i_prime
-					
-					if len(t.exposures) > 2:
-						output_rows.append(self.nickel_filter_row(Constants.V_band, t.exposures[Constants.V_band]))
-						output_rows.append(self.nickel_filter_row(Constants.B_band, t.exposures[Constants.B_band]))
-						last_filter = Constants.B_band
-					
-				# Flip order: BVi'r'
-				else:
-					tgt_row.append(Constants.B_band)
-					tgt_row.append(20) # Acquisition in B
-					output_rows.append(tgt_row)
-
-					output_rows.append(self.nickel_filter_row(Constants.B_band, t.exposures[Constants.B_band]))
-					output_rows.append(self.nickel_filter_row(Constants.V_band, t.exposures[Constants.V_band]))
-					output_rows.append(self.nickel_filter_row(Constants.i_prime, t.exposures[Constants.i_prime]))
-					output_rows.append(self.nickel_filter_row(Constants.r_prime, t.exposures[Constants.r_prime]))
-					last_filter = Constants.r_prime
-					
-			writer.writerows(output_rows)
\ No newline at end of file
@@ -0,0 +1,133 @@
+import bisect
+
+import numpy as np
+
+# Occupancy of the telescope over one night, indexed in time steps from the start of the night.
+# Free time is kept as a sorted list of half-open gaps [start, end), plus a second list of the
+# same gaps ordered by (length, start) so that "all gaps of at least k steps" is a bisection.
+# Finding a gap is O(log g) for g gaps; reserve and release also insert into and delete from the
+# lists, which moves O(g) entries, so they are O(g) with a small constant -- never O(night length).
+# Per-step views (reserved, free_bits) are built from the gaps when asked for.
+class TimeSlots():
+    def __init__(self, length_of_night):
+        self.length_of_night = length_of_night
+
+        self.gap_starts = []
+        self.gap_ends = []
+        self.gaps_by_length = []
+
+        if length_of_night > 0:
+            self.add_gap(0, length_of_night)
+
+    def add_gap(self, start, end):
+        i = bisect.bisect_left(self.gap_starts, start)
+        self.gap_starts.insert(i, start)
+        self.gap_ends.insert(i, end)
+        bisect.insort(self.gaps_by_length, (end - start, start))
+
+    def remove_gap(self, i):
+        start = self.gap_starts.pop(i)
+        end = self.gap_ends.pop(i)
+        j = bisect.bisect_left(self.gaps_by_length, (end - start, start))
+        del self.gaps_by_length[j]
+
+    # Index of the gap containing step t, or None if t is reserved
+    def find_gap(self, t):
+        i = bisect.bisect_right(self.gap_starts, t) - 1
+        if i >= 0 and t < self.gap_ends[i]:
+            return i
+        return None
+
+    def is_free(self, start, end):
+        i = self.find_gap(start)
+        return i is not None and end <= self.gap_ends[i]
+
+    # All free gaps at least min_length steps long, as (start, end) pairs in time order. With lo/hi,
+    # gaps are first clipped to [lo, hi).
+    def gaps(self, min_length=1, lo=0, hi=None):
+        if lo <= 0 and hi is None:
+            i = bisect.bisect_left(self.gaps_by_length, (min_length, -1))
+            return sorted((start, start + length) for length, start in self.gaps_by_length[i:])
+
+        hi = self.length_of_night if hi is None else hi
+        gaps = []
+        i = max(0, bisect.bisect_right(self.gap_starts, lo) - 1)
+        while i < len(self.gap_starts) and self.gap_starts[i] < hi:
+            start, end = max(lo, self.gap_starts[i]), min(hi, self.gap_ends[i])
+            if end - start >= min_length:
+                gaps.append((start, end))
+            i += 1
+
+        return gaps
+
+    # Dense 0/1 array of the reserved steps, O(night length) to build
+    @property
+    def reserved(self):
+        reserved = np.ones(self.length_of_night)
+        for start, end in zip(self.gap_starts, self.gap_ends):
+            reserved[start:end] = 0
+        return reserved
+
+    # Packed mask (see step_bits) of the free steps in [lo, hi)
+    def free_bits(self, lo=0, hi=None):
+        bits = 0
+        for start, end in self.gaps(1, lo, hi):
+            bits |= step_bits(start, end)
+        return bits
+
+    # Reserve [start, end), which must lie within a single free gap
+    def reserve(self, start, end):
+        i = self.find_gap(start)
+        if i is None or end > self.gap_ends[i]:
+            raise ValueError("Time steps %s-%s are not free!" % (start, end))
+
+        gap_start, gap_end = self.gap_starts[i], self.gap_ends[i]
+        self.remove_gap(i)
+        if gap_start < start:
+            self.add_gap(gap_start, start)
+        if end < gap_end:
+            self.add_gap(end, gap_end)
+
+    # Return [start, end), which must be fully reserved, to the free gaps, merging with its neighbours
+    def release(self, start, end):
+        i = bisect.bisect_left(self.gap_starts, start)
+        if (i > 0 and self.gap_ends[i - 1] > start) or (i < len(self.gap_starts) and self.gap_starts[i] < end):
+            raise ValueError("Time steps %s-%s are not reserved!" % (start, end))
+
+        if i < len(self.gap_starts) and self.gap_starts[i] == end:
+            end = self.gap_ends[i]
+            self.remove_gap(i)
+        if i > 0 and self.gap_ends[i - 1] == start:
+            start = self.gap_starts[i - 1]
+            self.remove_gap(i - 1)
+        self.add_gap(start, end)
+
+    def copy(self):
+        time_slots = TimeSlots(0)
+        time_slots.length_of_night = self.length_of_night
+        time_slots.gap_starts = list(self.gap_starts)
+        time_slots.gap_ends = list(self.gap_ends)
+        time_slots.gaps_by_length = list(self.gaps_by_length)
+
+        return time_slots
+
+# Packed per-step masks: bit t of a Python int is time step t. Intersections are a single "&" and
+# cost about one machine word per 64 steps.
+def step_bits(start, end):
+    start, end = int(start), int(end)
+    return ((1 << (end - start)) - 1) << start if end > start else 0
+
+def unpack_steps(bits, length):
+    packed = np.frombuffer(bits.to_bytes((length + 7)//8, "little"), dtype=np.uint8)
+    return np.unpackbits(packed, count=length, bitorder="little").astype(bool)
+
+# Steps t where bits t .. t+k-1 are all set, by and-ing the mask with itself shifted: after each
+# round, bit t says whether the next "covered" bits are all set
+def run_starts(bits, k):
+    covered = 1
+    while covered < k:
+        shift = min(covered, k - covered)
+        bits &= bits >> shift
+        covered += shift
+
+    return bits
@@ -1,5 +1,12 @@
 from datetime import tzinfo, timedelta, datetime
 import csv
+import logging
+
+import numpy as np
+
+from Target import target_type_codes
+
+log = logging.getLogger(__name__)
 
 class UTC_Offset(tzinfo):
 
@@ -30,11 +37,124 @@ lick_pst_utc_offset = -8 # hours
 lick_pdt_utc_offset = -7 # hours
 
 
-# file_name assumed to be CSV with headers...
-def get_targets(file_name):
-    csvfile = open(file_name, 'r')
+# Typed, columnar target catalog: one record per CSV row, RA/Dec in radians, discovery date as
+# datetime64 (NaT for standards) and target type as the TargetType value
+catalog_dtype = np.dtype([
+    ("name", object),
+    ("ra", np.float64),
+    ("dec", np.float64),
+    ("priority", np.float64),
+    ("disc_date", "datetime64[s]"),
+    ("disc_mag", np.float64),
+    ("type", np.int8),
+    ("static_exp_time", np.float64), # NaN when the field is empty (see Telescope.compute_exposure_table)
+    ("est_abs_mag", np.float64),
+    ("host_dist_mpc", np.float64)
+])
+catalog_columns = 10
+
+# "hh:mm:ss.s" / "dd:mm:ss.s" (or space-separated, or plain decimal) -> decimal hours/degrees
+def parse_sexagesimal(values):
+    values = np.char.strip(np.asarray(values, dtype=str))
+    negative = np.char.startswith(values, "-")
+    values = np.char.replace(np.char.lstrip(values, "+-"), " ", ":")
+
+    whole, _, rest = np.char.partition(values, ":").T
+    minutes, _, seconds = np.char.partition(rest, ":").T
+    minutes = np.where(minutes == "", "0", minutes)
+    seconds = np.where(seconds == "", "0", seconds)
+
+    decimal = whole.astype(float) + minutes.astype(float)/60.0 + seconds.astype(float)/3600.0
+    return np.where(negative, -decimal, decimal)
+
+# Decimal values, with empty fields as NaN
+def optional_floats(values):
+    values = np.char.strip(np.asarray(values, dtype=str))
+    return np.where(values == "", "nan", values).astype(float)
+
+def parse_dates(values, types):
+    values = np.asarray(values, dtype=str)
+    dates = np.full(len(values), np.datetime64("NaT"), dtype="datetime64[s]")
+
+    needs_date = types != target_type_codes["STD"].value
+    try:
+        dates[needs_date] = values[needs_date].astype("datetime64[s]")
+    except ValueError:
+        # Not all ISO-8601; fall back to dateutil for this chunk only
+        from dateutil.parser import parse
+        dates[needs_date] = [np.datetime64(parse(v), "s") for v in values[needs_date]]
+
+    return dates
+
+# Parse one chunk of CSV rows into catalog records, all columns at once
+def parse_catalog_chunk(rows):
+    columns = list(zip(*rows))
+    records = np.empty(len(rows), dtype=catalog_dtype)
+
+    records["name"] = columns[0]
+    records["ra"] = np.radians(parse_sexagesimal(columns[1])*15.0)
+    records["dec"] = np.radians(parse_sexagesimal(columns[2]))
+    records["priority"] = np.asarray(columns[3], dtype=str).astype(float)
+    records["disc_mag"] = np.asarray(columns[5], dtype=str).astype(float)
+    records["static_exp_time"] = optional_floats(columns[7])
+    records["est_abs_mag"] = np.asarray(columns[8], dtype=str).astype(float)
+    records["host_dist_mpc"] = np.asarray(columns[9], dtype=str).astype(float)
+
+    codes, inverse = np.unique(np.asarray(columns[6], dtype=str), return_inverse=True)
+    for code in codes:
+        if code not in target_type_codes:
+            raise ValueError("Unrecognized target type '%s'!" % code)
+    records["type"] = np.asarray([target_type_codes[c].value for c in codes], dtype=np.int8)[inverse]
+    records["disc_date"] = parse_dates(columns[4], records["type"])
+
+    return records
+
+# Streams a targets CSV (with headers) in chunks of chunk_size rows into a catalog_dtype array.
+# Malformed rows are reported with their line number and skipped.
+def load_target_catalog(file_name, chunk_size=10000):
+    with open(file_name, 'r') as csvfile:
+        return read_target_catalog_csv(csvfile, file_name, chunk_size)
+
+# As load_target_catalog, from any iterable of CSV lines (e.g. an uploaded body); source names
+# it in warnings
+def read_target_catalog_csv(csvfile, source, chunk_size=10000):
+    chunks = []
+    bad_rows = []
+
     reader = csv.reader(csvfile, delimiter=',')
     next(reader, None) # Skip headers
-    data = list(reader)
-    
-    return data
\ No newline at end of file
+
+    while True:
+        rows = []
+        line_numbers = []
+        for row in reader:
+            if len(row) == 0:
+                continue
+            if len(row) < catalog_columns:
+                bad_rows.append((reader.line_num, "expected %s columns, found %s" % (catalog_columns, len(row))))
+                continue
+            rows.append(row[:catalog_columns])
+            line_numbers.append(reader.line_num)
+            if len(rows) == chunk_size:
+                break
+
+        if len(rows) == 0:
+            break
+
+        try:
+            chunks.append(parse_catalog_chunk(rows))
+        except ValueError:
+            # Re-parse row by row to find the offending lines
+            for row, line_number in zip(rows, line_numbers):
+                try:
+                    chunks.append(parse_catalog_chunk([row]))
+                except ValueError as e:
+                    bad_rows.append((line_number, e))
+
+    for line_number, reason in sorted(bad_rows, key=lambda b: b[0]):
+        log.warning("%s: skipping malformed row at line %s: %s", source, line_number, reason)
+
+    if len(chunks) == 0:
+        return np.empty(0, dtype=catalog_dtype)
+
+    return np.concatenate(chunks)
@@ -0,0 +1,23 @@
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+# The scheduler is a set of flat top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Benchmark import write_synthetic_catalog
+
+
+@pytest.fixture
+def options():
+    return {"cache_dir": None, "time_step": 60, "plot_dpi": 100, "plot_legend": False}
+
+# A seeded 400-target synthetic catalog (every target type) in a scratch working directory;
+# schedules and run reports are written to the working directory
+@pytest.fixture
+def catalog_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_synthetic_catalog("targets.csv", 400, datetime(2017, 6, 1), seed=0)
+    return "targets.csv"
@@ -0,0 +1,57 @@
+import json
+from datetime import timedelta
+
+import pytest
+
+from ScheduleServer import ScheduleService
+
+@pytest.fixture
+def service(catalog_file, options):
+    service = ScheduleService(options)
+    with open(catalog_file, "r") as csvinput:
+        service.upload_targets("test", csvinput.read())
+    return service
+
+def dispatch_at(service, utc_time):
+    return service.dispatch_next("test", "LCO", "Swope", "20170601", utc_time.isoformat())
+
+def test_not_started_before_the_night(service):
+    dispatcher = service.dispatcher("test", "LCO", "Swope", "20170601")
+    night_start = dispatcher.observatory.utc_begin_night
+
+    reply = dispatch_at(service, night_start - timedelta(hours=1))
+
+    assert reply == {"target": None, "status": "not started", "night_start": night_start.isoformat()}
+    assert dispatcher.current_step == 0
+
+def test_next_skip_done(service):
+    dispatcher = service.dispatcher("test", "LCO", "Swope", "20170601")
+    now = dispatcher.observatory.utc_begin_night + timedelta(hours=2)
+
+    first = dispatch_at(service, now)
+    assert first["status"] == "observing" and first["target"] is not None
+    assert dispatch_at(service, now)["target"] == first["target"] # offered until done or skipped
+
+    service.dispatch_update("test", "LCO", "Swope", "20170601", "skip", first["target"], 30)
+    second = dispatch_at(service, now)
+    assert second["target"] not in (None, first["target"])
+
+    service.dispatch_update("test", "LCO", "Swope", "20170601", "done", second["target"])
+    third = dispatch_at(service, now)
+    assert third["target"] not in (None, first["target"], second["target"])
+
+    # Skipped for the rest of the night: never offered again, and the progress stays valid JSON
+    service.dispatch_update("test", "LCO", "Swope", "20170601", "skip", third["target"])
+    json.dumps(dispatcher.progress(), allow_nan=False)
+
+    offered = set()
+    for minutes in range(0, 12*60, 10):
+        reply = dispatch_at(service, now + timedelta(minutes=minutes))
+        offered.add(reply["target"])
+    assert third["target"] not in offered and second["target"] not in offered
+    assert reply["status"] == "over"
+
+def test_duplicate_names_are_rejected(service):
+    with pytest.raises(ValueError, match="Duplicate target names"):
+        service.upload_targets("test", "Name,RA,Dec,Priority,DiscDate,DiscMag,Type,StaticExpTime,EstAbsMag,HostDistMpc\n" + \
+                               "A,13:29:52.7,-47:11:43,1,2017-05-20,17.5,SN,,-17.5,50.0\n" * 2)
@@ -0,0 +1,66 @@
+from datetime import timedelta
+
+import pytest
+
+from CreateSchedule import build_observatory, build_targets
+from Optimizer import target_value
+from RunMetrics import RunMetrics
+from Utilities import load_target_catalog
+
+@pytest.fixture
+def scheduled_observatory(catalog_file, options):
+    obs = build_observatory("LCO", "20170601", options)
+    telescope = obs.telescopes["Swope"]
+    telescope.set_targets(build_targets(load_target_catalog(catalog_file), obs, RunMetrics()))
+    obs.schedule_targets("Swope", plot=False)
+
+    return obs
+
+def schedule_value(targets):
+    return sum(target_value(t) for t in targets)
+
+def test_remove_started_target_keeps_consumed_time(scheduled_observatory):
+    obs = scheduled_observatory
+    state = obs.schedules["Swope"]
+    first = min(state["scheduled"], key=lambda t: t.starting_index)
+
+    consumed_steps = first.starting_index + len(first.scheduled_time_array) + 60
+    obs.consume_time("Swope", obs.utc_begin_night + timedelta(seconds=consumed_steps*obs.time_step))
+    started = set(t.name for t in state["scheduled"] if t.starting_index < consumed_steps)
+
+    scheduled, unscheduled = obs.remove_targets("Swope", [first.name])
+
+    assert first.name not in [t.name for t in scheduled]
+    assert all(t.starting_index >= consumed_steps for t in scheduled if t.name not in started)
+    assert state["time_slots"].reserved[:consumed_steps].all()
+
+# Raising one long unplaced block to priority 1 used to pre-empt a chain of targets worth far more
+# than it (ten targets lost on this catalog)
+def test_priority_update_does_not_cascade(scheduled_observatory):
+    obs = scheduled_observatory
+    state = obs.schedules["Swope"]
+    fits = [t for t in state["unscheduled"] if t.priority > 1 and \
+            any(end - start >= obs.minutes_to_steps(t.total_minutes) for start, end in t.observable_windows)]
+    raised = max(fits, key=lambda t: (t.total_minutes, t.name))
+    num_before = len(state["scheduled"])
+    value_before = schedule_value(state["scheduled"])
+
+    scheduled, unscheduled = obs.update_priorities("Swope", {raised.name: 1})
+
+    assert schedule_value(scheduled) >= value_before
+    assert len(scheduled) >= num_before - 1
+
+def test_added_targets_do_not_lower_schedule_value(scheduled_observatory, options):
+    obs = scheduled_observatory
+    state = obs.schedules["Swope"]
+    value_before = schedule_value(state["scheduled"])
+
+    records = load_target_catalog("targets.csv")[:20]
+    records["name"] = ["N%06d" % i for i in range(len(records))]
+    records["priority"] = 1
+    new_targets = build_targets(records, obs, RunMetrics())
+
+    scheduled, unscheduled = obs.add_targets("Swope", new_targets)
+
+    assert schedule_value(scheduled) >= value_before
+    assert all(t in scheduled or t in unscheduled for t in new_targets)
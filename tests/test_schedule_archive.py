@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from CreateSchedule import build_observatory, build_targets
+from RunMetrics import RunMetrics
+from ScheduleArchive import ScheduleArchive, archive_dtype
+from Utilities import load_target_catalog
+
+def night_rows(date, observatory, telescope, targets):
+    rows = np.zeros(len(targets), dtype=archive_dtype)
+    rows["date"] = np.datetime64(date)
+    rows["observatory"] = observatory
+    rows["telescope"] = telescope
+    rows["target"] = targets
+    return rows
+
+@pytest.fixture
+def archive(tmp_path):
+    archive = ScheduleArchive(str(tmp_path / "archive"))
+    archive.append(night_rows("2017-06-01", "LCO", "Swope", ["A", "B", "C"]), night=(np.datetime64("2017-06-01"), "LCO", "Swope"))
+    archive.append(night_rows("2017-06-01", "Lick", "Nickel", ["A", "D"]), night=(np.datetime64("2017-06-01"), "Lick", "Nickel"))
+    archive.append(night_rows("2017-06-02", "LCO", "Swope", ["B"]), night=(np.datetime64("2017-06-02"), "LCO", "Swope"))
+    return archive
+
+def test_rerun_night_replaces_its_rows(archive):
+    archive.append(night_rows("2017-06-01", "LCO", "Swope", ["E"]), night=(np.datetime64("2017-06-01"), "LCO", "Swope"))
+
+    assert len(archive) == 4
+    assert sorted(archive.query(observatory="LCO")["target"]) == ["B", "E"]
+    assert sorted(archive.query(observatory="Lick")["target"]) == ["A", "D"]
+
+def test_query_filters(archive):
+    assert len(archive.query()) == 6
+    assert sorted(archive.query(start_date="20170602")["target"]) == ["B"]
+    assert sorted(archive.query(end_date="20170601", observatory="LCO")["target"]) == ["A", "B", "C"]
+    assert sorted(archive.query(telescope="Nickel")["target"]) == ["A", "D"]
+    assert list(archive.query(target="B")["date"]) == [np.datetime64("2017-06-01"), np.datetime64("2017-06-02")]
+    assert len(archive.query(start_date="20170603")) == 0
+
+def test_scheduling_a_night_twice_archives_it_once(catalog_file, options):
+    archive = ScheduleArchive("archive")
+    for run in range(2):
+        obs = build_observatory("LCO", "20170601", options)
+        obs.telescopes["Swope"].set_targets(build_targets(load_target_catalog(catalog_file), obs, RunMetrics()))
+        scheduled, unscheduled = obs.schedule_targets("Swope", plot=False, archive=archive)
+
+    rows = archive.query(observatory="LCO", telescope="Swope")
+    assert sorted(rows["target"]) == sorted(t.name for t in scheduled)
+    assert np.all(rows["start_index"] >= 0) and np.all(rows["num_steps"] > 0)
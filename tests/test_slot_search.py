@@ -0,0 +1,20 @@
+import pytest
+
+from CreateSchedule import build_observatory, build_targets
+from RunMetrics import RunMetrics
+from Utilities import load_target_catalog
+
+# The slot finders are different engines for the same search: each must place every target at the
+# same steps
+@pytest.mark.parametrize("obs_key, tele_key", [("LCO", "Swope"), ("Lick", "Nickel")])
+def test_slot_finders_agree(catalog_file, options, obs_key, tele_key):
+    placements = {}
+    for slot_search in ["greedy", "prefix", "packed"]:
+        obs = build_observatory(obs_key, "20170601", options)
+        obs.telescopes[tele_key].set_targets(build_targets(load_target_catalog(catalog_file), obs, RunMetrics()))
+        scheduled, unscheduled = obs.schedule_targets(tele_key, slot_search=slot_search, plot=False)
+        placements[slot_search] = sorted((t.name, t.starting_index, len(t.scheduled_time_array)) for t in scheduled)
+
+    assert len(placements["prefix"]) > 0
+    assert placements["greedy"] == placements["prefix"]
+    assert placements["packed"] == placements["prefix"]
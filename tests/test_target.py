@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+import Constants
+from CreateSchedule import build_observatory
+from Target import compute_airmass_matrix, observable_windows
+
+# The closed-form windows must select exactly the steps where the sampled airmass is within the
+# threshold, including targets that never rise and ones that set and rise again during the night
+@pytest.mark.parametrize("obs_key", ["LCO", "Lick"])
+@pytest.mark.parametrize("time_step", [60, 300])
+def test_windows_match_thresholded_airmass(options, obs_key, time_step):
+    options = dict(options, time_step=time_step)
+    obs = build_observatory(obs_key, "20170601", options)
+    rng = np.random.default_rng(1)
+    ra = rng.uniform(0, 2*np.pi, 2000)
+    dec = np.arcsin(rng.uniform(-1, 1, 2000))
+
+    starts, ends = observable_windows(ra, dec, obs.ephemeris.lat, obs.sidereal_radian_array, Constants.airmass_threshold)
+    in_windows = np.zeros((len(ra), len(obs.sidereal_radian_array)), dtype=bool)
+    for i in range(len(ra)):
+        for start, end in zip(starts[i], ends[i]):
+            in_windows[i, start:end] = True
+
+    airmass = compute_airmass_matrix(ra, dec, obs.ephemeris.lat, obs.sidereal_radian_array)
+    assert np.array_equal(in_windows, airmass <= Constants.airmass_threshold)
+    assert (~in_windows).all(axis=1).any() and (ends[:, 1] > starts[:, 1]).any()
@@ -0,0 +1,22 @@
+import pytest
+
+from CreateSchedule import build_observatory, build_targets
+from RunMetrics import RunMetrics
+from Utilities import load_target_catalog
+
+# The batch exposure table must give every target the exposures of its type's reference
+# compute_*_exposure function, including GW_Static rows with no StaticExpTime
+@pytest.mark.parametrize("obs_key, tele_key", [("LCO", "Swope"), ("Lick", "Nickel")])
+def test_exposure_table_matches_reference(catalog_file, options, obs_key, tele_key):
+    records = load_target_catalog(catalog_file)
+    records["static_exp_time"][::3] = float("nan")
+
+    obs = build_observatory(obs_key, "20170601", options)
+    telescope = obs.telescopes[tele_key]
+    targets = build_targets(records, obs, RunMetrics())
+    assert len(set(t.type for t in targets)) == len(telescope.exp_funcs)
+
+    exposures, is_int = telescope.compute_exposure_table(targets)
+    for tgt, row, row_is_int in zip(targets, exposures, is_int):
+        telescope.exp_funcs[tgt.type](tgt) # sets tgt.exposures
+        assert telescope.exposure_dict(row, row_is_int) == pytest.approx(tgt.exposures), tgt.name
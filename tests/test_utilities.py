@@ -0,0 +1,38 @@
+import logging
+
+import numpy as np
+
+from Utilities import load_target_catalog
+
+header = "Name,RA,Dec,Priority,DiscDate,DiscMag,Type,StaticExpTime,EstAbsMag,HostDistMpc\n"
+good_row = "%s,13:29:52.7,-47:11:43,1,2017-05-20,17.5,SN,,-17.5,50.0\n"
+
+def test_malformed_rows_are_reported_by_line(tmp_path, caplog):
+    catalog_file = tmp_path / "targets.csv"
+    catalog_file.write_text(header + \
+                            good_row % "A" + \
+                            "B,13:29:52.7,-47:11:43,1\n" + \
+                            good_row % "C" + \
+                            "D,13:29:52.7,-47:11:43,1,2017-05-20,17.5,Comet,,-17.5,50.0\n" + \
+                            "E,13:29:52.7,-47:11:43,high,2017-05-20,17.5,SN,,-17.5,50.0\n" + \
+                            good_row % "F")
+
+    with caplog.at_level(logging.WARNING, logger="Utilities"):
+        records = load_target_catalog(str(catalog_file), chunk_size=2)
+
+    assert list(records["name"]) == ["A", "C", "F"]
+    warnings = [r.getMessage() for r in caplog.records]
+    assert len(warnings) == 3
+    assert "line 3: expected 10 columns, found 4" in warnings[0]
+    assert "line 5" in warnings[1] and "Comet" in warnings[1]
+    assert "line 6" in warnings[2]
+
+def test_empty_static_exposure_is_nan(tmp_path):
+    catalog_file = tmp_path / "targets.csv"
+    catalog_file.write_text(header + good_row % "A" + \
+                            "B,13:29:52.7,-47:11:43,1,2017-05-20,17.5,GW_Static,90,-17.5,50.0\n")
+
+    records = load_target_catalog(str(catalog_file))
+
+    assert np.isnan(records["static_exp_time"][0])
+    assert records["static_exp_time"][1] == 90